@@ -0,0 +1,157 @@
+import hashlib
+import struct
+
+import numpy as np
+
+"""
+Holds the state of a GameBoy in one contiguous buffer. The MemoryController's regions are views into the buffer, so
+they are always up to date in it. The registers and the rest of the CPU, memory controller and GPU state are kept
+in attributes while running, as they are used by every instruction, and are packed into the buffer by store. After
+a store the whole machine is the buffer, so a snapshot is one copy and a hash is one call. The ROM is not part of
+the state.
+
+Layout
+------------
+0x00 - Magic b"PGBS", Version (uint32), Size of the state (uint32)
+CPU - Registers a, b, c, d, e, f, h, l, pc, sp (uint16), Flags z, n, h, c, ime, if (uint8), Halted (uint8),
+      Clock (uint64), Clocks of the last instruction (uint32)
+Memory - BIOS in use, Banking type (uint8), ROM bank (uint16), Memory model, ERAM disabled, ERAM bank, RTC disabled,
+         RTC mapped, RTC latch, Seconds, Minutes, Hours (uint8), Days (uint16), RTC flags, Interrupt enable,
+         Buttons held, RTC register mapped, RTC halted (uint8), RTC base (int64), RTC stopped time (uint64)
+GPU - Enabled (uint8), Frame start (uint64), V-Blank, Line, Window line, Rendering, Frame changed (uint8),
+      Frame number (uint64)
+Joypad - Queued changes which have happened (uint64)
+Then the memory regions VRAM, ERAM (all banks), WRAM, OAM, IO and high RAM, the (144, 160) uint8 map being drawn
+and the last complete frame
+"""
+
+MAGIC = b"PGBS"
+VERSION = 4
+
+HEADER = struct.Struct("<4sII")
+CPU_STATE = struct.Struct("<10H7BQI")
+MEMORY_STATE = struct.Struct("<BBH9BHBBBBBqQ")
+GPU_STATE = struct.Struct("<BQ5BQ")
+JOYPAD_STATE = struct.Struct("<Q")
+
+REGISTERS = ["a", "b", "c", "d", "e", "f", "h", "l", "pc", "sp"]
+FLAGS = ["z", "n", "h", "c", "ime", "if"]
+
+MEMORY_FIELDS = ["bios_use", "banking_type", "currBank", "memory_model", "disable_eram", "eram_bank", "disable_rtc",
+                 "map_rtc", "latch_rtc", "seconds", "minutes", "hours", "days", "flags", "interrupt_enable",
+                 "buttons", "rtc_register", "rtc_halted", "rtc_base", "rtc_stopped"]
+
+GPU_FIELDS = ["enabled", "frame_start", "vblank", "line", "window_line", "rendering", "frame_changed",
+              "frame_number"]
+
+# The MemoryController's regions, in the order they are laid out
+REGIONS = [("vram", 0x2000), ("eram", 0x2000 * 0x10), ("wram", 0x2000), ("oam", 0xA0), ("io", 0x4C), ("ram", 0x7F)]
+
+FRAME_SIZE = 144 * 160
+
+CPU_OFFSET = HEADER.size
+MEMORY_OFFSET = CPU_OFFSET + CPU_STATE.size
+GPU_OFFSET = MEMORY_OFFSET + MEMORY_STATE.size
+JOYPAD_OFFSET = GPU_OFFSET + GPU_STATE.size
+REGIONS_OFFSET = JOYPAD_OFFSET + JOYPAD_STATE.size
+FRAMES_OFFSET = REGIONS_OFFSET + sum(size for name, size in REGIONS)
+
+STATE_SIZE = FRAMES_OFFSET + 2 * FRAME_SIZE
+
+
+def check_state(buffer):
+    if len(buffer) < STATE_SIZE or HEADER.unpack_from(buffer, 0) != (MAGIC, VERSION, STATE_SIZE):
+        raise ValueError("Not a pythongb save state")
+
+
+class StateArena(object):
+    # Uses the given buffer of at least STATE_SIZE bytes, such as shared memory, or a new one
+    def __init__(self, buffer=None):
+        if buffer is None:
+            buffer = bytearray(STATE_SIZE)
+
+        self.buffer = memoryview(buffer).cast("B")[:STATE_SIZE]
+
+        if len(self.buffer) < STATE_SIZE:
+            raise ValueError("A state needs %d bytes" % STATE_SIZE)
+
+        self.regions = {}
+        offset = REGIONS_OFFSET
+
+        for name, size in REGIONS:
+            self.regions[name] = self.buffer[offset:offset + size]
+            offset += size
+
+        # The map being drawn and the last complete frame, copied in by store
+        self.frames = np.ndarray((2, 144, 160), np.uint8, self.buffer, FRAMES_OFFSET)
+
+    # Packs the state kept outside the buffer into it
+    def store(self, gameboy):
+        cpu = gameboy.cpu
+        memory = cpu.memory
+        gpu = gameboy.gpu
+
+        buffer = self.buffer
+
+        HEADER.pack_into(buffer, 0, MAGIC, VERSION, STATE_SIZE)
+
+        CPU_STATE.pack_into(buffer, CPU_OFFSET, *([cpu.r[name] & 0xFFFF for name in REGISTERS] +
+                                                  [cpu.flag[name] for name in FLAGS] +
+                                                  [cpu.halted, cpu.clock, cpu.last_clock_inc]))
+
+        MEMORY_STATE.pack_into(buffer, MEMORY_OFFSET, *[getattr(memory, name) for name in MEMORY_FIELDS])
+        GPU_STATE.pack_into(buffer, GPU_OFFSET, *[getattr(gpu, name) for name in GPU_FIELDS])
+        JOYPAD_STATE.pack_into(buffer, JOYPAD_OFFSET, gameboy.joypad.position)
+
+        self.frames[0] = gpu.map
+        self.frames[1] = gpu.frames[gpu.front]
+
+    # Unpacks the state kept outside the buffer from it, the opposite of store. Between frames the GPU's maps can be
+    # left as they are, as nothing drawn so far is needed
+    def restore(self, gameboy, frames=True):
+        cpu = gameboy.cpu
+        memory = cpu.memory
+        gpu = gameboy.gpu
+
+        buffer = self.buffer
+        check_state(buffer)
+
+        values = CPU_STATE.unpack_from(buffer, CPU_OFFSET)
+
+        cpu.r.update(zip(REGISTERS, values[:10]))
+        cpu.flag.update(zip(FLAGS, values[10:16]))
+        cpu.halted, cpu.clock, cpu.last_clock_inc = bool(values[16]), values[17], values[18]
+
+        for name, value in zip(MEMORY_FIELDS, MEMORY_STATE.unpack_from(buffer, MEMORY_OFFSET)):
+            setattr(memory, name, value)
+
+        for name in ("bios_use", "disable_eram", "disable_rtc", "map_rtc", "rtc_halted"):
+            setattr(memory, name, bool(getattr(memory, name)))
+
+        for name, value in zip(GPU_FIELDS, GPU_STATE.unpack_from(buffer, GPU_OFFSET)):
+            setattr(gpu, name, value)
+
+        for name in ("enabled", "vblank", "rendering", "frame_changed"):
+            setattr(gpu, name, bool(getattr(gpu, name)))
+
+        if frames:
+            gpu.map[:] = self.frames[0]
+            gpu.frames[gpu.front][:] = self.frames[1]
+
+        gpu.reload()
+
+        gameboy.joypad.restore(*JOYPAD_STATE.unpack_from(buffer, JOYPAD_OFFSET))
+
+    # A copy of the whole buffer, call store first
+    def snapshot(self):
+        return bytes(self.buffer)
+
+    # Copies a snapshot back into the buffer, call restore after
+    def load(self, state):
+        state = memoryview(state).cast("B")
+        check_state(state)
+
+        self.buffer[:] = state[:STATE_SIZE]
+
+    def digest(self):
+        return hashlib.blake2b(self.buffer, digest_size=16).digest()
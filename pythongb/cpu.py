@@ -46,7 +46,15 @@ class CPU(object):
         self.clock = 0
         self.last_clock_inc = 0
 
+        # Set by HALT, no instructions are run until an interrupt is requested
+        self.halted = False
+
+        # The opcode tables, made on the first instruction
+        self.opcodes = None
+        self.cb_opcodes = None
+
         self.memory = MemoryController(debug)
+        self.memory.attach_cpu(self)
 
     """ Helper Functions """
     def getHL(self):
@@ -64,7 +72,7 @@ class CPU(object):
         self.r["sp"] &= 0xFFFF
 
     def addAB(self, a, b, value):
-        val = (self.r[a] << 8 | self.r[b]) + value
+        val = ((self.r[a] << 8 | self.r[b]) + value) & 0xFFFF
         self.r[a] = val >> 8
         self.r[b] = 0x00FF & val
 
@@ -682,6 +690,7 @@ class CPU(object):
         # Set the remaining flags
         self.flag["n"] = 0
         self.flag["c"] = 1 if self.r["sp"] > 0xFFFF else 0
+        self.r["sp"] &= 0xFFFF
 
     # Increment the register pair AB
     def incnn(self, a, b):
@@ -693,12 +702,13 @@ class CPU(object):
 
     # Increment the SP
     def incsp(self):
-        self.r["sp"] += 1
+        self.addSP(1)
 
     # Decrement the register pair AB
     def decnn(self, a, b):
         final = (self.r[a] << 8 | self.r[b]) - 1
 
+        final &= 0xFFFF
         self.r[a] = final >> 8
         self.r[b] = final & 0x00FF
 
@@ -747,9 +757,8 @@ class CPU(object):
         pass
 
     # Power down the CPU until some interrupt occurs.
-    # TODO Implement this
     def halt(self):
-        pass
+        self.halted = True
 
     # Halt the CPU and display
     # TODO Implement this
@@ -1202,10 +1211,10 @@ class CPU(object):
         high = self.memory.read(self.r["pc"])
 
         # Write the PC to the stack
-        self.r["sp"] -= 1
+        self.addSP(-1)
         self.memory.write(self.r["sp"], self.r["pc"] >> 8)
 
-        self.r["sp"] -= 1
+        self.addSP(-1)
         self.memory.write(self.r["sp"], self.r["pc"] & 0xFF)
 
         self.r["pc"] = (high << 8 | low)
@@ -1220,10 +1229,10 @@ class CPU(object):
             high = self.memory.read(self.r["pc"])
 
             # Write the PC to the stack
-            self.r["sp"] -= 1
+            self.addSP(-1)
             self.memory.write(self.r["sp"], self.r["pc"] >> 8)
 
-            self.r["sp"] -= 1
+            self.addSP(-1)
             self.memory.write(self.r["sp"], self.r["pc"] & 0xFF)
 
             self.r["pc"] = (high << 8 | low)
@@ -1242,10 +1251,10 @@ class CPU(object):
             high = self.memory.read(self.r["pc"])
 
             # Write the PC to the stack
-            self.r["sp"] -= 1
+            self.addSP(-1)
             self.memory.write(self.r["sp"], self.r["pc"] >> 8)
 
-            self.r["sp"] -= 1
+            self.addSP(-1)
             self.memory.write(self.r["sp"], self.r["pc"] & 0xFF)
 
             self.r["pc"] = (high << 8 | low)
@@ -1264,10 +1273,10 @@ class CPU(object):
             high = self.memory.read(self.r["pc"])
 
             # Write the PC to the stack
-            self.r["sp"] -= 1
+            self.addSP(-1)
             self.memory.write(self.r["sp"], self.r["pc"] >> 8)
 
-            self.r["sp"] -= 1
+            self.addSP(-1)
             self.memory.write(self.r["sp"], self.r["pc"] & 0xFF)
 
             self.r["pc"] = (high << 8 | low)
@@ -1286,10 +1295,10 @@ class CPU(object):
             high = self.memory.read(self.r["pc"])
 
             # Write the PC to the stack
-            self.r["sp"] -= 1
+            self.addSP(-1)
             self.memory.write(self.r["sp"], self.r["pc"] >> 8)
 
-            self.r["sp"] -= 1
+            self.addSP(-1)
             self.memory.write(self.r["sp"], self.r["pc"] & 0xFF)
 
             self.r["pc"] = (high << 8 | low)
@@ -1300,10 +1309,10 @@ class CPU(object):
     """ Restart Opcodes """
     # Push the current address onto the stack and jump to address 0x0000 + n
     def rstn(self, n):
-        self.r["sp"] -= 1
+        self.addSP(-1)
         self.memory.write(self.r["sp"], self.r["pc"] >> 8)
 
-        self.r["sp"] -= 1
+        self.addSP(-1)
         self.memory.write(self.r["sp"], self.r["pc"] & 0xFF)
 
         self.r["pc"] = 0x0000 + n
@@ -1370,10 +1379,9 @@ class CPU(object):
 
         self.flag["ime"] = 1
 
-    def cbtable(self):
-        self.incPC()
-
-        lookup = {
+    # The 0xCB prefixed opcodes, made once by cbtable
+    def cb_opcode_table(self):
+        return {
             # SWAP n
             0x37: (self.swapn, ["a"], 8),
             0x30: (self.swapn, ["b"], 8),
@@ -1673,7 +1681,13 @@ class CPU(object):
 
         }
 
-        function = lookup[self.memory.read(self.r["pc"])]
+    def cbtable(self):
+        self.incPC()
+
+        if self.cb_opcodes is None:
+            self.cb_opcodes = self.cb_opcode_table()
+
+        function = self.cb_opcodes[self.memory.read(self.r["pc"])]
 
         if self.debug:
             print("Exec Opcode: " + function[0].__name__)
@@ -1774,8 +1788,9 @@ class CPU(object):
         function[0](*function[1])
 
     # Opcode Maps
-    def executeOpcode(self, opcode):
-        map = {
+    # Maps each opcode to its function, arguments and clocks, made once by executeOpcode
+    def opcode_table(self):
+        return {
             # LD nn, n
             0x06: (self.ldnnn, ["b"], 8),
             0x0E: (self.ldnnn, ["c"], 8),
@@ -2137,7 +2152,12 @@ class CPU(object):
             0xD9: (self.reti, [], 8)
         }
 
-        function = map[opcode]
+    def executeOpcode(self, opcode):
+        # Making the table for every instruction took most of the time spent running one
+        if self.opcodes is None:
+            self.opcodes = self.opcode_table()
+
+        function = self.opcodes[opcode]
         if self.debug:
             print("Exec Opcode: " + function[0].__name__)
             print("Params: " + str(function[1]))
@@ -0,0 +1,121 @@
+# The vispy display, this is only imported when a window is asked for as it pulls in OpenGL
+from vispy import app, gloo
+
+import numpy as np
+
+
+class GBCanvas(app.Canvas):
+    # Shows the frames published by a GPU, which is run by another thread
+    def __init__(self, gpu):
+        self.vertex_shader = """
+            attribute vec2 position;
+            void main()
+            {
+                gl_Position = vec4(position, 0.0, 1.0);
+            }
+        """
+
+        # The texture holds the shade of each pixel, which is looked up in the palette here. The screen is
+        # scaled by a whole number and centred in the window
+        self.fragment_shader = """
+            uniform sampler2D texture;
+            uniform sampler2D palette;
+            uniform vec2 viewport;
+            uniform float scale;
+            void main()
+            {
+                vec2 size = vec2(160.0, 144.0);
+                vec2 offset = floor((viewport - size * scale) / 2.0);
+                vec2 pixel = floor((gl_FragCoord.xy - offset) / scale);
+
+                // The first line of the texture is the top of the screen
+                pixel.y = size.y - 1.0 - pixel.y;
+
+                if (any(lessThan(pixel, vec2(0.0))) || any(greaterThanEqual(pixel, size))) {
+                    gl_FragColor = vec4(0.0, 0.0, 0.0, 1.0);
+                    return;
+                }
+
+                float shade = floor(texture2D(texture, (pixel + 0.5) / size).r * 255.0 + 0.5);
+                gl_FragColor.rgb = texture2D(palette, vec2((shade + 0.5) / 4.0, 0.5)).rgb;
+                gl_FragColor.a = 1.0;
+            }
+        """
+
+        # The shades last uploaded, used to find the lines which have changed
+        self.frame = np.zeros((144, 160), dtype=np.uint8)
+
+        app.Canvas.__init__(self, size=(160, 144), keys="interactive", show=True)
+
+        self.program = gloo.Program(self.vertex_shader, self.fragment_shader, count=4)
+        self.program['position'] = [(-1, -1), (-1, +1), (+1, -1), (+1, +1)]
+
+        self.texture = gloo.Texture2D(self.frame, format="luminance", interpolation="nearest")
+        self.program['texture'] = self.texture
+        self.program['palette'] = gloo.Texture2D(gpu.colours.reshape(1, 4, 3), interpolation="nearest")
+
+        self.on_resize(None)
+
+        # Check for a new frame at the GameBoy's refresh rate
+        self.gpu = gpu
+        self.shown_frames = gpu.published_frames
+
+        self.timer = app.Timer(1 / 60.0, connect=self.on_timer, start=True)
+
+    def on_timer(self, event):
+        # Only frames which are different to the last one are published
+        if self.gpu.published_frames != self.shown_frames:
+            self.shown_frames = self.gpu.published_frames
+            self.set_frame(self.gpu.latest_frame())
+
+    def set_frame(self, frame):
+        # Only upload the lines between the first and last one which have changed
+        changed = np.flatnonzero((frame != self.frame).any(axis=1))
+
+        if len(changed) == 0:
+            return
+
+        first = changed[0]
+        last = changed[-1] + 1
+
+        self.frame[first:last] = frame[first:last]
+        self.texture.set_data(self.frame[first:last], offset=(first, 0))
+
+        self.update()
+
+    def on_resize(self, event):
+        width, height = self.physical_size
+        gloo.set_viewport(0, 0, width, height)
+
+        self.program['viewport'] = (width, height)
+        self.program['scale'] = max(1, min(width // 160, height // 144))
+
+    def on_draw(self, event):
+        gloo.clear(color=True, depth=True)
+        self.program.draw("triangle_strip")
+
+
+# Renderer which shows the frames in a window, the window has to be run on the main thread
+class VispyRenderer(object):
+    interactive = True
+
+    def __init__(self, gpu):
+        self.gpu = gpu
+        self.canvas = GBCanvas(gpu)
+
+    # Frames are picked up by the canvas
+    def draw(self, frame):
+        pass
+
+    # Stops checking for frames while the emulation is paused, so the window does nothing until something happens
+    def set_paused(self, paused):
+        if paused:
+            self.canvas.timer.stop()
+        else:
+            self.canvas.timer.start()
+
+    # Runs the window until it is closed, calling on_close when it is
+    def run(self, on_close):
+        self.canvas.events.close.connect(lambda event: on_close())
+
+        app.run()
@@ -0,0 +1,116 @@
+import numpy as np
+
+from .gb import GameBoy
+from .memory import MemoryController
+
+"""
+An environment for training agents on a ROM, in the style of Gym. Each step holds the buttons for an action and runs
+frame_skip frames, only drawing the last. Observations are uint8 arrays, either the shades (0 - 3) or grayscale
+(255 white to 0 black), optionally downsampled by taking every n-th pixel. They are written into an array given by
+the caller, so stepping doesn't allocate a new one each time.
+
+Parts of the memory can be watched through views, these are NumPy arrays over the memory itself so they always hold
+the current values without copying.
+"""
+
+# The buttons held for each action, by default nothing or a single button
+ACTIONS = [[], ["a"], ["b"], ["start"], ["select"], ["up"], ["down"], ["left"], ["right"]]
+
+# The memory regions views can be made into, by where they start and the MemoryController attribute
+REGIONS = [(0x8000, 0xA000, "vram"), (0xC000, 0xE000, "wram"), (0xFE00, 0xFEA0, "oam"), (0xFF00, 0xFF4C, "io"),
+           (0xFF80, 0xFFFF, "ram")]
+
+
+# The shape of the observations when downsampled by taking every downsample-th pixel
+def observation_shape(downsample=1):
+    downsample = max(int(downsample), 1)
+
+    return -(-144 // downsample), -(-160 // downsample)
+
+
+class GameBoyEnv(object):
+    def __init__(self, rom_path, frame_skip=4, observation="grayscale", downsample=1, actions=ACTIONS):
+        if observation not in ("shades", "grayscale"):
+            raise ValueError("Unknown observation: " + str(observation))
+
+        self.gameboy = GameBoy()
+        self.gameboy.load_rom(rom_path)
+
+        self.frame_skip = max(int(frame_skip), 1)
+        self.downsample = max(int(downsample), 1)
+
+        self.actions = [sum(MemoryController.BUTTONS[name] for name in set(buttons)) for buttons in actions]
+
+        # Looks up the value of each shade in an observation
+        if observation == "grayscale":
+            self.lookup = np.array([self.gameboy.gpu.palette_map[i][0] for i in range(4)], np.uint8)
+        else:
+            self.lookup = np.arange(4, dtype=np.uint8)
+
+        self.observation_shape = observation_shape(self.downsample)
+
+        # The state reset goes back to, from when the ROM was loaded until set_start is called
+        self.start = None
+        self.set_start()
+
+    # Makes reset go back to the current state
+    def set_start(self):
+        arena = self.gameboy.cpu.memory.arena
+        arena.store(self.gameboy)
+
+        self.start = arena.snapshot()
+
+    # An array the right shape and type to hold an observation
+    def make_observation(self):
+        return np.zeros(self.observation_shape, np.uint8)
+
+    def observe(self, out=None):
+        if out is None:
+            out = self.make_observation()
+
+        frame = self.gameboy.gpu.latest_frame()
+
+        if self.downsample > 1:
+            frame = frame[::self.downsample, ::self.downsample]
+
+        np.take(self.lookup, frame, out=out)
+
+        return out
+
+    def info(self):
+        return {"frame": self.gameboy.gpu.frame_number, "clock": self.gameboy.cpu.clock}
+
+    # Goes back to the start, or to the given state from save_state. Returns the observation and info
+    def reset(self, out=None, state=None):
+        arena = self.gameboy.cpu.memory.arena
+        arena.load(self.start if state is None else state)
+        arena.restore(self.gameboy)
+
+        self.gameboy.joypad.clear()
+
+        return self.observe(out), self.info()
+
+    # Holds the buttons of the action for frame_skip frames. Returns the observation and info
+    def step(self, action, out=None):
+        gameboy = self.gameboy
+
+        gameboy.set_buttons(self.actions[action])
+
+        # Only the frame observed is drawn
+        gameboy.gpu.skip_frames(self.frame_skip - 1)
+
+        for i in range(self.frame_skip):
+            gameboy.run_frame()
+
+        return self.observe(out), self.info()
+
+    # A uint8 view of the memory from start up to end, which must be inside one of the regions in REGIONS. It stays
+    # up to date as the emulation runs and is reset, until the memory is moved by GameBoy.share_state
+    def memory_view(self, start, end):
+        for region_start, region_end, name in REGIONS:
+            if region_start <= start < end <= region_end:
+                region = getattr(self.gameboy.cpu.memory, name)
+
+                return np.frombuffer(region, np.uint8)[start - region_start:end - region_start]
+
+        raise ValueError("No memory region holds 0x%04X - 0x%04X" % (start, end))
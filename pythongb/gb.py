@@ -1,98 +1,323 @@
 from .gpu import GPU
 from .cpu import CPU
 from .memory import MemoryController
+from .joypad import Joypad
 
-import OpenGL.GLUT as glut
-import OpenGL.GL as gl
-import numpy as np
-from vispy import app, gloo
+from .pacer import FramePacer
+from .renderers import get_renderer
 
+import threading
 import time
 
 class GameBoy(object):
-    class GBCanvas(app.Canvas):
-        def __init__(self):
-            self.vertex_shader = """
-                attribute vec2 position;
-                attribute vec2 texcoord;
-                varying vec2 v_texcoord;
-                void main()
-                {
-                    gl_Position = vec4(position, 0.0, 1.0);
-                    v_texcoord = texcoord;
-                }
-            """
-
-            self.fragment_shader = """
-                uniform sampler2D texture;
-                varying vec2 v_texcoord;
-                void main()
-                {
-                    vec3 clr = texture2D(texture, v_texcoord).rgb;
-                    gl_FragColor.rgb = clr;
-                    gl_FragColor.a = 1.0;
-                }
-            """
-
-            self.texture = np.zeros((160, 144, 3), dtype=np.float32)
-
-            app.Canvas.__init__(self, size=(160, 148), keys="interactive", show=True)
-
-            self.program = gloo.Program(self.vertex_shader, self.fragment_shader, count=4)
-            self.program['position'] = [(-1, -1), (-1, +1), (+1, -1), (+1, +1)]
-            self.program['texcoord'] = [(0, 1), (0, 0), (1, 1), (1, 0)]
-
-            self.program['texture'] = self.texture
-
-        def set_frame(self, texture):
-            self.texture = texture
-            self.program["texture"] = texture
-
-            self.update()
-
-        def on_draw(self, event):
-            gloo.clear(color=True, depth=True)
-            self.program.draw("triangle_strip")
-
-    def __init__(self, debug):
+    def __init__(self, debug=False):
         # Perform launch operations
         self.cpu = CPU(debug)
         self.gpu = GPU(self.cpu.memory)
 
         self.cpu.memory.attach_gpu(self.gpu)
+        self.gpu.attach_cpu(self.cpu)
 
-        # Holds a frame to be rendered to the window
-        self.frame = np.zeros([160, 144], dtype=np.uint8)
+        self.joypad = Joypad(self.cpu)
 
         self.running = True
 
+        # Cleared while paused, the emulation thread waits on this
+        self.resumed = threading.Event()
+        self.resumed.set()
+
+        # Set by the emulation thread while it is waiting to be resumed
+        self.waiting = threading.Event()
+
+        # The renderer being used by run
+        self.renderer = None
+
+        # In turbo mode the emulation runs as fast as it can, otherwise the pacer keeps it to the GameBoy's frame rate
+        self.turbo = False
+        self.pacer = FramePacer()
+
         self.debug = debug
 
-    def run(self, rom_path):
-        # Firstly load the ROM
+        # Called with the GameBoy at the end of each run_frame, when it is safe to save or load the state
+        self.frame_hooks = []
+
+        # The RewindBuffer once rewind is enabled
+        self.rewinder = None
+
+        # The number of frames to run ahead of the one shown, see run_frame_ahead
+        self.run_ahead = 0
+
+    def load_rom(self, rom_path):
         self.cpu.memory.read_rom(rom_path)
 
-        # Setup a canvas
-        canvas = GameBoy.GBCanvas()
+    # Runs a single instruction
+    def step(self):
+        # Changes to the buttons queued for this point happen before the instruction
+        if self.cpu.clock >= self.joypad.next_event:
+            self.joypad.update()
+
+        if self.cpu.halted:
+            self.idle()
+            return
+
+        # Increment the PC
+        if self.debug:
+            print("Exec PC: " + str(hex(self.cpu.r["pc"])))
+
+        # Firstly execute an instruction
+        self.cpu.executeOpcode(self.cpu.memory.read(self.cpu.r["pc"]))
+
+        # The GPU only needs to run at the V-Blank and interrupts, the rest is worked out from the clock
+        if self.cpu.clock >= self.gpu.next_event:
+            self.gpu.update()
+
+        self.cpu.incPC()
+
+    # While halted nothing happens until an interrupt, so move the clock straight on to the GPU's or joypad's next
+    # event
+    def idle(self):
+        if self.cpu.memory.interrupt_pending():
+            self.cpu.halted = False
+            return
+
+        wake = self.gpu.next_event
+
+        if wake == GPU.NEVER:
+            # With the LCD off there is nothing to wait for, so move on a line at a time
+            wake = self.cpu.clock + GPU.LINE_CLOCKS
+
+        self.cpu.clock = max(self.cpu.clock + 4, min(wake, self.joypad.next_event))
+
+        if self.cpu.clock >= self.gpu.next_event:
+            self.gpu.update()
+
+        if self.cpu.clock >= self.joypad.next_event:
+            self.joypad.update()
+
+    # Runs until the GPU finishes a frame, or for as long as a frame would take while the LCD is off
+    def run_frame(self):
+        self.advance_frame()
 
-        app.run()
+        for hook in self.frame_hooks:
+            hook(self)
+
+        return self.gpu.latest_frame()
+
+    # The same as run_frame without calling the frame hooks, for frames which are going to be undone
+    def advance_frame(self):
+        frame_number = self.gpu.frame_number
+        end = self.cpu.clock + GPU.FRAME_CLOCKS
+
+        while self.gpu.frame_number == frame_number and self.cpu.clock < end:
+            self.step()
+
+    # Runs a frame, then runs on the given number of frames to draw the frame which will be shown then, and goes
+    # back. Input takes effect on the frame shown straight away, rather than after the frames a game takes to react
+    def run_frame_ahead(self, frames):
+        # Nothing is going to be drawn when the pacer is skipping frames
+        if frames <= 0 or self.gpu.skipped_frames:
+            return self.run_frame()
+
+        # Only the last frame ahead is drawn
+        self.gpu.skip_frames(frames)
+        self.run_frame()
+
+        arena = self.cpu.memory.arena
+        arena.store(self)
+        state = arena.snapshot()
+
+        for i in range(frames):
+            self.advance_frame()
+
+        # The frame drawn ahead is left in the GPU's maps to be shown
+        arena.load(state)
+        arena.restore(self, frames=False)
+
+        return self.gpu.latest_frame()
+
+    # Shows the frame this many frames ahead of the emulation, 0 turns run ahead off
+    def set_run_ahead(self, frames):
+        self.run_ahead = max(int(frames), 0)
+
+    # The emulation loop, for a window this runs on its own thread so the display never holds it up
+    def emulate(self, renderer=None):
+        self.pacer.reset()
 
         while self.running:
-            # Increment the PC
-            if self.debug:
-                print("Exec PC: " + str(hex(self.cpu.r["pc"])))
+            # Block until resumed, rather than using the CPU
+            if not self.resumed.is_set():
+                self.waiting.set()
+                self.resumed.wait()
+                self.waiting.clear()
+
+                self.pacer.reset()
+                continue
+
+            self.run_frame_ahead(self.run_ahead)
+
+            if renderer is not None and self.gpu.image_ready:
+                frame = self.gpu.get_frame()
+
+                if not self.gpu.frame_unchanged:
+                    renderer.draw(frame)
+
+            # Wait for the frame to be due, skipping the drawing of the next frames if the host has fallen behind
+            if not self.turbo:
+                self.gpu.skip_frames(self.pacer.wait())
+
+    # Turbo mode runs as fast as the host allows, drawing only 1 of every render_every frames
+    def set_turbo(self, enabled, render_every=1):
+        self.turbo = enabled
+        self.gpu.set_frame_skip(render_every if enabled else 1)
+
+        # Don't try to make up for the time spent in turbo
+        self.pacer.reset()
+
+    # Publishes the frames into shared memory for other processes to read with a SharedFrameReader
+    def share_frames(self, name=None, slots=3):
+        from .sharedframes import SharedFrameWriter
+
+        return SharedFrameWriter(self.gpu, name, slots)
 
-            # Firstly execute an instruction
-            self.cpu.executeOpcode(self.cpu.memory.read(self.cpu.r["pc"]))
+    # Moves the state into shared memory for other processes to read with a SharedStateReader
+    def share_state(self, name=None):
+        from .sharedstate import SharedStateWriter
+
+        return SharedStateWriter(self, name)
+
+    # Records the frames drawn to path on a background thread, see recorder.FrameRecorder for the options
+    def record(self, path, format="raw", **options):
+        from .recorder import FrameRecorder
+
+        return FrameRecorder(self.gpu, path, format, **options)
+
+    # Streams the frames to viewers connecting to address, a (host, port) pair or the path of a Unix socket
+    def serve_frames(self, address=("127.0.0.1", 0)):
+        from .stream import FrameServer
+
+        return FrameServer(self.gpu, address)
+
+    # Holds down the given buttons, either a mask of the bits in MemoryController.BUTTONS or a list of their names
+    def set_buttons(self, buttons):
+        if not isinstance(buttons, int):
+            buttons = sum(MemoryController.BUTTONS[name] for name in set(buttons))
+
+        self.joypad.set_buttons(buttons)
+
+    # Records the buttons held from now on into a movie, see movie.py
+    def record_movie(self, path):
+        from .movie import MovieRecorder
+
+        return MovieRecorder(self, path)
+
+    # Plays a movie back as fast as possible, returning the number of frames run
+    def play_movie(self, path, render_every=1):
+        from .movie import play_movie
+
+        return play_movie(self, path, render_every)
+
+    # Sets the time of the cartridge's clock (MBC3) in seconds, or to the host's day of the year and time if None.
+    # From then on it keeps time with the CPU clock, not the host's
+    def set_rtc(self, seconds=None):
+        if seconds is None:
+            now = time.localtime()
+            seconds = ((now.tm_yday - 1) * 24 + now.tm_hour) * 3600 + now.tm_min * 60 + now.tm_sec
+
+        self.cpu.memory.set_rtc_time(seconds)
+
+    # Makes an independent GameBoy in the same state, to run on from here without changing this one. The ROM is
+    # shared, only the state arena and the queued joypad changes are copied
+    def fork(self):
+        child = GameBoy(self.debug)
+        child.cpu.memory.rom = self.cpu.memory.rom
+        child.joypad.events = list(self.joypad.events)
+
+        arena = self.cpu.memory.arena
+        arena.store(self)
+
+        child.cpu.memory.arena.load(arena.buffer)
+        child.cpu.memory.arena.restore(child)
+
+        child.gpu.set_frame_skip(self.gpu.frame_skip)
+        child.turbo = self.turbo
+
+        return child
+
+    # Saves the whole machine, see savestate.py for the layout. Returns the state, and writes it to path if given
+    def save_state(self, path=None):
+        from .savestate import save_state
+
+        return save_state(self, path)
+
+    # Loads a state from save_state, either the state itself or the path of a file holding it
+    def load_state(self, state):
+        from .savestate import load_state
+
+        load_state(self, state)
+
+    # Starts keeping snapshots to rewind to, see rewind.RewindBuffer for the options
+    def enable_rewind(self, **options):
+        from .rewind import RewindBuffer
+
+        if self.rewinder is not None:
+            self.rewinder.close()
+
+        self.rewinder = RewindBuffer(self, **options)
+
+        return self.rewinder
+
+    # Takes the emulation back the given number of frames, returning how many it went back
+    def rewind(self, frames):
+        if self.rewinder is None:
+            raise ValueError("Rewind has not been enabled")
+
+        return self.rewinder.rewind(frames)
+
+    # Pausing takes effect at the end of the current frame. Returns an event which the emulation thread sets once it
+    # has stopped
+    def pause(self):
+        self.resumed.clear()
+
+        if self.renderer is not None and self.renderer.interactive:
+            self.renderer.set_paused(True)
+
+        return self.waiting
+
+    def resume(self):
+        if self.renderer is not None and self.renderer.interactive:
+            self.renderer.set_paused(False)
+
+        self.waiting.clear()
+        self.resumed.set()
+
+    def paused(self):
+        return not self.resumed.is_set()
+
+    def stop(self):
+        self.running = False
+
+        # Wake the emulation thread if it is paused so it can finish
+        self.resumed.set()
+
+    # Runs the ROM until stopped, the renderer is one of those in renderers.RENDERERS
+    def run(self, rom_path, renderer="vispy"):
+        # Firstly load the ROM
+        self.load_rom(rom_path)
+
+        self.renderer = get_renderer(renderer, self.gpu)
+        self.running = True
 
-            # Sync the GPU with the CPU
-            self.gpu.sync(self.cpu.last_clock_inc)
+        if not self.renderer.interactive:
+            self.emulate(self.renderer)
+            return
 
-            # Get a frame if it is ready
-            frame = self.gpu.get_frame()
+        # The window picks up the frames as the GPU finishes them
+        worker = threading.Thread(target=self.emulate, name="pythongb-emulation")
+        worker.daemon = True
+        worker.start()
 
-            if frame is not None:
-                # Place the frame into the current
-                canvas.set_frame(frame)
+        self.renderer.run(self.stop)
 
-            self.cpu.incPC()
\ No newline at end of file
+        # The window has been closed
+        self.stop()
+        worker.join()
@@ -1,30 +1,64 @@
 # Reference: http://imrannazar.com/GameBoy-Emulation-in-JavaScript:-GPU-Timings
 from .utils import *
-from math import floor
 
 import numpy as np
 
 
 class GPU(object):
-    def __init__(self, mem_controller):
+    def __init__(self, mem_controller, buffers=3):
         # It needs to have access to main memory
         self.memory = mem_controller
 
-        self.clock = 0
+        # The CPU drives the clock, the GPU works out where it is from it (Empty until attached)
+        self.cpu = None
 
-        # Holds the current mode for the CPU defined below:
-        # 0 - HBlank, drawing of a line (51 Clocks)
-        # 1 - VBlank, when all the lines are drawn, in this case, the image will be pushed to the screen (114 Clocks)
-        # 2 - Scanline (Accessing OAM) (20 Clocks)
-        # 3 - Scanline (Accessing VRAM) (43 Clocks)
-        self.mode = 0
-        self.interrupt_type = 0
+        # The GPU only runs while bit 7 of the LCD control register is set
+        self.enabled = False
+
+        # The CPU clock at which the current frame started
+        self.frame_start = 0
+
+        # Set once the V-Blank of the current frame has been signalled
+        self.vblank = False
+
+        # Only 1 in every frame_skip frames is drawn, the others keep their timings but no lines are drawn
+        self.frame_skip = 1
+        self.rendering = True
+
+        # The number of upcoming frames not to draw, for when the emulation is running behind
+        self.skipped_frames = 0
+
+        # The CPU clock at which update should next be called, for the V-Blank, end of frame or an LCD interrupt
+        self.next_event = GPU.NEVER
+        self.lcd_interrupt = GPU.NEVER
 
         # Holds the current line that would be drawn to
         self.line = 0
 
-        # Create a 160x144 map for the bitmap
-        self.map = np.zeros((160, 144, 3), np.float32)
+        # The line of the window to be drawn next, this only moves on when the window is shown
+        self.window_line = 0
+
+        # A ring of 160x144 maps of the shade (0 - 3) of each pixel, indexed by line then x. Lines are drawn into the
+        # back map (self.map) while the last complete frame is left alone, a frame handed out stays the same until
+        # the GPU has gone round the ring. The display looks the shades up in palette_map
+        self.frames = []
+        self.set_frame_buffers([np.zeros((144, 160), np.uint8) for i in range(buffers)])
+
+        # Called with the GPU each time a frame is drawn, after it has been published
+        self.frame_listeners = []
+
+        # Counts the frames completed since the GPU was created, and how many of them were different to the last
+        self.frame_number = 0
+        self.published_frames = 0
+
+        # Count the writes which changed the VRAM and OAM, so a line is only drawn again if what it shows has changed
+        self.vram_version = 0
+        self.oam_version = 0
+
+        # Which lines were drawn again in the current frame, and whether the last frame is the same as the one before
+        self.changed_lines = np.zeros(144, np.bool_)
+        self.frame_changed = False
+        self.frame_unchanged = False
 
         # Palette to colour map
         self.palette_map = {
@@ -34,8 +68,22 @@ class GPU(object):
             3: (0, 0, 0)
         }
 
+        # The same colours as an array, so a whole frame of shades can be looked up at once
+        self.colours = np.array([self.palette_map[i] for i in range(4)], np.float32) / 255.0
+
         # A GPU internal set of tiles 128 + 255 tiles with y and x coords
-        self.tiles = [[[0 for x in range(8)] for y in range(8)] for i in range(128 + 255 + 1)]
+        self.tiles = np.zeros((128 + 255 + 1, 8, 8), np.uint8)
+
+        # Views onto the memory used while drawing, these avoid going through memory.read
+        self.vram = None
+        self.oam = None
+        self.map_memory()
+
+        # Sprites to draw on each line, in priority order. Rebuilt only when the OAM or sprite size changes
+        self.sprite_lines = [np.zeros(0, np.intp) for i in range(144)]
+        self.sprite_table = np.zeros((40, 4), np.int16)
+        self.sprite_height = 8
+        self.sprites_outdated = True
 
         self.image_ready = False
 
@@ -60,203 +108,444 @@ class GPU(object):
 
         self.DMA_CONTROL = 0xFF46
 
-    # Creates the tile map from the set of tile held in the memory of the gameboy
-    # This may not be necessary.
-    def build_tile_data(self):
-        tiles_start = 0x8000
-        tiles_end = 0x9800
-        y = 0
+    # Timings in CPU clocks, the modes of each line are as follows:
+    # 2 - Scanline (Accessing OAM) (80 Clocks)
+    # 3 - Scanline (Accessing VRAM) (172 Clocks), the line is drawn at the end of this
+    # 0 - HBlank (204 Clocks)
+    # 1 - VBlank, for the 10 lines after all 144 are drawn, in this case, the image will be pushed to the screen
+    OAM_CLOCKS = 80
+    LINE_DRAWN_CLOCKS = 80 + 172
+    LINE_CLOCKS = 456
+    VBLANK_CLOCKS = 144 * LINE_CLOCKS
+    FRAME_CLOCKS = 154 * LINE_CLOCKS
 
-        tile = 0
+    NEVER = float("inf")
 
-        for i in range(0, tiles_end - tiles_start, 2):
-            line1 = self.memory.read(tiles_start + i)
-            line2 = self.memory.read(tiles_start + i + 1)
+    # Used to split a byte of tile data into its 8 pixels, leftmost pixel first
+    BIT_SHIFTS = np.arange(7, -1, -1, dtype=np.uint8)
 
-            for x in range(8):
-                self.tiles[tile][y][x] = (line1 >> 7 - x) & 0x1 | ((line2 >> 7 - x) & 0x1) << 1
+    # Each shade in a palette register is 2 bits, colour 0 in the lowest
+    PALETTE_SHIFTS = np.array([0, 2, 4, 6], np.uint8)
 
-            y += 1
+    PIXELS = np.arange(160)
+    SPRITE_PIXELS = np.arange(8)
 
-            if y == 8:
-                y = 0
-                tile += 1
+    # Creates the tile map from the set of tile held in the memory of the gameboy
+    def build_tile_data(self):
+        data = self.vram[:0x1800].reshape(384, 8, 2, 1)
+
+        self.tiles[:] = (data[:, :, 0] >> GPU.BIT_SHIFTS) & 0x1 | ((data[:, :, 1] >> GPU.BIT_SHIFTS) & 0x1) << 1
+
+    # Called when a byte of the VRAM changes
+    def update_vram(self, write_location):
+        self.vram_version += 1
+
+        if write_location < 0x9800:
+            self.update_tiles(write_location)
 
     # This a function that is called that updates a particular tile when a write
     # is issued to the VRAM in memory
     def update_tiles(self, write_location):
-        # Find the tile it belongs to in memory
-        tile_location = int(floor(write_location / 16) * 16)
+        # Each line of a tile is 2 bytes, find the first one
+        offset = (write_location - 0x8000) & 0xFFFE
 
-        y = int(round((write_location - tile_location) / 2))
-        tile = (tile_location - 0x8000) / 16
+        tile = offset >> 4
+        y = (offset >> 1) & 0x7
 
         # Now update this whole line
-        line1 = self.memory.read(tile_location + y * 2)
-        line2 = self.memory.read(tile_location + (y * 2) + 1)
-        for x in range(8):
-            self.tiles[tile][y][x] = (line1 >> 7 - x) & 0x1 | ((line2 >> 7 - x) & 0x1) << 1
+        line1 = self.memory.vram[offset]
+        line2 = self.memory.vram[offset + 1]
+
+        self.tiles[tile, y] = (line1 >> GPU.BIT_SHIFTS) & 0x1 | ((line2 >> GPU.BIT_SHIFTS) & 0x1) << 1
+
+    # Called when the memory has been moved to a new buffer
+    def map_memory(self):
+        self.vram = np.frombuffer(self.memory.vram, np.uint8)
+        self.oam = np.frombuffer(self.memory.oam, np.uint8)
+
+    # Called after the memory has been loaded from a saved state, anything worked out from it is thrown away
+    def reload(self):
+        # No line drawn before can be trusted to match, so make sure the keys of every line differ
+        self.vram_version += 1
+        self.oam_version += 1
+
+        self.build_tile_data()
+        self.sprites_outdated = True
+
+        self.schedule()
+
+    # Called when the OAM is written to, the sprite lists are rebuilt when the next line is drawn
+    def update_oam(self, write_location):
+        self.oam_version += 1
+        self.sprites_outdated = True
+
+    def read_palette(self, location):
+        return (self.memory.io[location - 0xFF00] >> GPU.PALETTE_SHIFTS) & 0b11
+
+    # Works out which sprites are on every line, so drawing a line does not scan the whole OAM
+    def build_sprite_lines(self):
+        self.sprite_table[:] = self.oam.reshape(40, 4)
+
+        top = self.sprite_table[:, 0] - 16
+        lines = np.arange(144)[:, None]
+
+        visible = (lines >= top) & (lines < top + self.sprite_height)
+        x = self.sprite_table[:, 1]
+
+        for line in range(144):
+            # Only the first 10 sprites in the OAM are shown on a line
+            sprites = np.flatnonzero(visible[line])[:10]
+
+            # The sprite furthest left is drawn on top, the OAM order breaks ties
+            self.sprite_lines[line] = sprites[np.argsort(x[sprites], kind="stable")]
+
+        self.sprites_outdated = False
+
+    # Returns the colour numbers (before the palette is applied) of the pixels at x along line y of a tile map
+    def map_line(self, tile_screen_map, y, x, lcd_control):
+        # The 32 tiles in the row of the map this line falls in
+        row_start = tile_screen_map - 0x8000 + (y >> 3) * 32
+        tiles = self.vram[row_start:row_start + 32]
+
+        # Map the tile appropriately, if it is signed then tile 0 is at 0x9000
+        if not (lcd_control >> 4) & 0x1:
+            tiles = tiles.view(np.int8).astype(np.int16) + 256
+
+        return self.tiles[tiles[x >> 3], y & 7, x & 7]
+
+    def background_line(self, lcd_control):
+        tile_screen_map = 0x9C00 if (lcd_control >> 3) & 0x1 else 0x9800
+
+        actual_y = (self.line + self.memory.io[self.SCROLL_Y - 0xFF00]) & 0xFF
+        actual_x = (self.memory.io[self.SCROLL_X - 0xFF00] + GPU.PIXELS) & 0xFF
+
+        return self.map_line(tile_screen_map, actual_y, actual_x, lcd_control)
+
+    # Places the window over the background colours of the current line
+    def draw_window(self, colours, lcd_control, window_line):
+        window_x = self.memory.io[self.WINDOW_X - 0xFF00] - 7
+
+        tile_screen_map = 0x9C00 if (lcd_control >> 6) & 0x1 else 0x9800
+
+        # A window partly off the left of the screen is cut, rather than moved
+        start = max(window_x, 0)
+
+        x = GPU.PIXELS[:160 - start] + (start - window_x)
+
+        colours[start:] = self.map_line(tile_screen_map, window_line, x, lcd_control)
+
+    # Draws the sprites on the current line over the shades of the background
+    def draw_sprites(self, colours, shades):
+        sprites = self.sprite_lines[self.line]
+
+        if len(sprites) == 0:
+            return
+
+        sprite = self.sprite_table[sprites]
+        attributes = sprite[:, 3]
+
+        # Find the row of each sprite on this line, flipping it vertically if needed
+        row = self.line - (sprite[:, 0] - 16)
+        row = np.where(attributes & 0x40, self.sprite_height - 1 - row, row)
+
+        tile = sprite[:, 2]
+
+        if self.sprite_height == 16:
+            tile = tile & 0xFE
+
+        pixels = self.tiles[tile + (row >> 3), row & 7]
+        pixels = np.where((attributes & 0x20)[:, None] != 0, pixels[:, ::-1], pixels)
+
+        x = (sprite[:, 1] - 8)[:, None] + GPU.SPRITE_PIXELS
+        shown = (pixels != 0) & (x >= 0) & (x < 160)
+
+        # The sprites are in priority order, so the first solid pixel at each x is the one drawn
+        x = x[shown]
+        x, first = np.unique(x, return_index=True)
+
+        pixels = pixels[shown][first]
+        attributes = np.broadcast_to(attributes[:, None], shown.shape)[shown][first]
+
+        palette = np.where(attributes & 0x10, self.read_palette(self.PALETTE1_DATA)[pixels],
+                           self.read_palette(self.PALETTE0_DATA)[pixels])
+
+        # Sprites with the priority bit set are hidden behind background colours 1-3
+        drawn = ((attributes & 0x80) == 0) | (colours[x] == 0)
+
+        shades[x[drawn]] = palette[drawn]
 
     def draw_line(self):
+        io = self.memory.io
+
         # Read the LCD control register
-        lcd_control = self.memory.read(self.LCD_CONTROL)
+        lcd_control = io[self.LCD_CONTROL - 0xFF00]
+
+        # The window restarts from its first line each frame
+        if self.line == 0:
+            self.window_line = 0
+            self.frame_changed = False
 
-        # Decide if we are rendering the window or not
-        window = True if (lcd_control & 0b00100000) >> 5 == 1 else False
+        # The window keeps its own line count, so hiding it for some lines does not skip rows of the window
+        window_line = self.window_line
+        window = (lcd_control & 0x21 == 0x21 and self.line >= io[self.WINDOW_Y - 0xFF00] and
+                  io[self.WINDOW_X - 0xFF00] < 167)
 
-        # Decide which screen map to draw from first
         if window:
-            tile_screen_map = 0x9C00 if (lcd_control >> 6) & 0x1 else 0x9800
+            self.window_line += 1
+
+        # Everything the line depends on, if none of it has changed the line from the last frame is kept
+        key = (lcd_control, io[self.SCROLL_Y - 0xFF00], io[self.SCROLL_X - 0xFF00], io[self.PALETTE - 0xFF00],
+               io[self.PALETTE0_DATA - 0xFF00], io[self.PALETTE1_DATA - 0xFF00], io[self.WINDOW_Y - 0xFF00],
+               io[self.WINDOW_X - 0xFF00], window_line, self.vram_version, self.oam_version)
+
+        changed = key != self.frame_keys[self.front][self.line]
+        self.changed_lines[self.line] = changed
+
+        if changed:
+            self.frame_changed = True
+
+        # The back map may already hold this line from when it was last used
+        if key == self.line_keys[self.line]:
+            return
+
+        self.line_keys[self.line] = key
+
+        if not changed:
+            self.map[self.line] = self.frames[self.front][self.line]
+            return
+
+        if lcd_control & 0x01:
+            colours = self.background_line(lcd_control)
+
+            if window:
+                self.draw_window(colours, lcd_control, window_line)
         else:
-            tile_screen_map = 0x9C00 if (lcd_control >> 3) & 0x1 else 0x9800
+            # The background is blank
+            colours = np.zeros(160, np.uint8)
+
+        shades = self.read_palette(self.PALETTE)[colours]
 
-        # Decide which tile map to draw from
-        tile_vram_map = 0x8000 if (lcd_control >> 4) & 0x1 else 0x8800
+        if lcd_control & 0x02:
+            height = 16 if lcd_control & 0x04 else 8
 
-        actual_y = self.line + self.memory.read(self.SCROLL_Y)
-        actual_x = self.memory.read(self.SCROLL_X)
+            if self.sprites_outdated or height != self.sprite_height:
+                self.sprite_height = height
+                self.build_sprite_lines()
 
-        tile_y = int(floor(actual_y / 8))
-        tile_x = int(floor(actual_x / 8))
+            self.draw_sprites(colours, shades)
 
-        y_tile_offset = actual_y & 7
-        x_tile_offset = actual_x & 7
+        self.map[self.line] = shades
 
-        tile = self.memory.read(tile_screen_map + tile_y + tile_x)
+    # Called at the V-Blank, makes the back map the frame to be shown and moves on to the next map in the ring
+    def publish_frame(self):
+        self.frame_number += 1
 
-        # Map the tile appropriately, if it is negative
-        if tile_vram_map == 0x8800:
-            if tile > 127:
-                tile = -(((tile ^ 0xFF) + 1) & 0xFF)
+        # Nothing was drawn, so there is nothing to show
+        if not self.rendering:
+            return
 
-            tile += 128
+        self.frame_unchanged = not self.frame_changed
 
-        # Load the palette
-        pal = self.memory.read(self.PALETTE)
-        palette = (pal & 0b11, (pal & 0b1100) >> 2, (pal & 0b110000) >> 4, (pal & 0b11000000) >> 6)
+        # The frame being shown is already the same, so keep drawing into the same map
+        if not self.frame_unchanged:
+            self.front = self.back
+            self.back = (self.back + 1) % len(self.frames)
 
-        for i in range(160):
-            # Now place the tile into the image
-            tile_value = self.tiles[tile][y_tile_offset][x_tile_offset]
+            self.map = self.frames[self.back]
+            self.line_keys = self.frame_keys[self.back]
 
-            final = self.palette_map[palette[tile_value]]
+            self.published_frames += 1
 
-            self.map[i, self.line, 0] = final[0] / 255.0
-            self.map[i, self.line, 1] = final[1] / 255.0
-            self.map[i, self.line, 2] = final[2] / 255.0
+        self.image_ready = True
 
-            x_tile_offset += 1
+        for listener in self.frame_listeners:
+            listener(self)
 
-            if x_tile_offset == 8:
-                x_tile_offset = 0
+    # Draws into the given (144, 160) uint8 maps from now on, such as ones in shared memory. The last frame and
+    # the lines drawn so far are carried over
+    def set_frame_buffers(self, frames):
+        front, back = len(frames) - 1, 0
+
+        if self.frames:
+            frames[front][:] = self.frames[self.front]
+            frames[back][:] = self.frames[self.back]
+
+            keys = [[None] * 144 for i in range(len(frames))]
+            keys[front] = self.frame_keys[self.front]
+            keys[back] = list(self.frame_keys[self.back])
+        else:
+            keys = [[None] * 144 for i in range(len(frames))]
 
-                tile_x += 1
+        self.frames = frames
+        self.frame_views = [frame.view() for frame in frames]
 
-                tile = self.memory.read(tile_screen_map + tile_y + tile_x)
+        for view in self.frame_views:
+            view.flags.writeable = False
 
-                if tile_vram_map == 0x8800:
-                    if tile > 127:
-                        tile = -(((tile ^ 0xFF) + 1) & 0xFF)
+        # What each line of each map was drawn with
+        self.frame_keys = keys
 
-                    tile += 128
+        self.back = back
+        self.front = front
+        self.map = self.frames[self.back]
+        self.line_keys = self.frame_keys[self.back]
+
+    # Returns a read only view of the last complete frame
+    def latest_frame(self):
+        return self.frame_views[self.front]
 
     def get_frame(self):
         if self.image_ready:
             self.image_ready = False
-            return self.map
+            return self.latest_frame()
 
         return None
 
-    # This function syncs the GPU with the CPUs clock
-    def sync(self, cycles):
-        self.clock += cycles
+    def attach_cpu(self, cpu):
+        self.cpu = cpu
 
-        # OAM Access
-        if self.mode == 2:
-            if self.clock >= 20:
-                # Move to OAM access mode
-                self.mode = 3
+    # The position of the CPU clock in the current frame
+    def frame_clock(self):
+        return (self.cpu.clock - self.frame_start) % GPU.FRAME_CLOCKS
 
-                # Write that it is switching to a OAM interrupt
-                self.interrupt_type &= 0b11000000
+    # Works out the mode and line from the CPU clock when the status or LY registers are read
+    def read_register(self, location):
+        if not self.enabled:
+            line = 0
+            mode = 0
+        else:
+            line, dot = divmod(self.frame_clock(), GPU.LINE_CLOCKS)
 
-                self.interrupt_type |= 0b00100000
-                self.interrupt_type |= self.mode
+            if line >= 144:
+                mode = 1
+            elif dot < GPU.OAM_CLOCKS:
+                mode = 2
+            elif dot < GPU.LINE_DRAWN_CLOCKS:
+                mode = 3
+            else:
+                mode = 0
 
-                self.memory.write(self.LCD_STATUS, self.interrupt_type)
+        if location == self.LCD_Y_LINE:
+            return line
 
-                self.clock = 0
+        status = self.memory.io[self.LCD_STATUS - 0xFF00] & 0b01111000
 
-        # VRAM Mode
-        elif self.mode == 3:
-            if self.clock >= 43:
-                self.mode = 0
+        if line == self.memory.io[self.LY_COMPARE - 0xFF00]:
+            status |= 0b00000100
 
-                # Write a line to the frame buffer
-                self.clock = 0
+        return 0x80 | status | mode
 
-                # Write that it is switching to a H-blank interrupt
-                self.interrupt_type &= 0b11000000
+    # Called when the GPU registers are written, after the value has been stored
+    def update_register(self, location, data):
+        if location == self.LCD_CONTROL:
+            enabled = data & 0x80 != 0
 
-                self.interrupt_type |= 0b00001000
-                self.interrupt_type |= self.mode
+            if enabled and not self.enabled:
+                # The LCD starts again from the top of the screen
+                self.start_frame(self.cpu.clock)
 
-                self.memory.write(self.LCD_STATUS, self.interrupt_type)
-                self.draw_line()
+            self.enabled = enabled
+            self.schedule()
 
-        # H-Blank
-        elif self.mode == 0:
-            if self.clock >= 51:
-                self.clock = 0
+        elif location == self.LCD_STATUS or location == self.LY_COMPARE:
+            self.schedule()
 
-                self.line += 1
+    def start_frame(self, clock):
+        self.frame_start = clock
+        self.line = 0
+        self.vblank = False
 
-                self.memory.write(self.LCD_Y_LINE, self.line)
+        self.rendering = self.frame_number % self.frame_skip == 0 and self.skipped_frames == 0
 
-                if self.line == 143:
-                    # Perform a VBlank
-                    self.mode = 1
+        if self.skipped_frames:
+            self.skipped_frames -= 1
 
-                    # Write that it is switching to a v-blank interrupt
-                    self.interrupt_type &= 0b11000000
+    # Only draw 1 in every frame_skip frames, from the next frame
+    def set_frame_skip(self, frame_skip):
+        self.frame_skip = max(int(frame_skip), 1)
 
-                    self.interrupt_type |= 0b00010000
-                    self.interrupt_type |= self.mode
+    # Don't draw the next count frames
+    def skip_frames(self, count):
+        self.skipped_frames = count
 
-                    # Push the image to be rendered
-                    # For testing purposes, just place it in a PIL container
-                    self.memory.write(self.LCD_Y_LINE, 144)
+    # Draws all the lines which the CPU clock has gone past, this is called before anything
+    # the drawing depends on is changed so the earlier lines are drawn as they were
+    def catch_up(self):
+        if not self.enabled or not self.rendering or self.line >= 144:
+            return
 
-                    self.image_ready = True
+        line_drawn = self.cpu.clock - self.frame_start - GPU.LINE_DRAWN_CLOCKS
 
-                else:
-                    # Move to VRAM access
-                    self.mode = 2
+        while self.line < 144 and self.line * GPU.LINE_CLOCKS <= line_drawn:
+            self.draw_line()
+            self.line += 1
 
-                    self.interrupt_type &= 0b11000000
+    # Called when the CPU clock reaches next_event
+    def update(self):
+        if not self.enabled:
+            self.next_event = GPU.NEVER
+            return
 
-                    self.interrupt_type |= 0b00010000
-                    self.interrupt_type |= self.mode
+        clock = self.cpu.clock
 
-                    self.memory.write(self.LCD_STATUS, self.interrupt_type)
+        while True:
+            self.catch_up()
 
-        # V-Blank
-        else:
-            if self.clock >= 114:
-                self.clock = 0
+            if not self.vblank:
+                if clock < self.frame_start + GPU.VBLANK_CLOCKS:
+                    break
+
+                self.vblank = True
+                self.publish_frame()
 
-                self.line += 1
+                # Request the V-Blank interrupt, and the LCD interrupt if it is enabled for V-Blank
+                self.memory.io[0x0F] |= 0x01
 
-                if self.line > 153:
-                    self.line = 0
-                    self.mode = 2
+                if self.memory.io[self.LCD_STATUS - 0xFF00] & 0b00010000:
+                    self.memory.io[0x0F] |= 0x02
 
-                    self.image_ready = False
+            if clock < self.frame_start + GPU.FRAME_CLOCKS:
+                break
 
-                    self.interrupt_type &= 0b11000000
+            self.start_frame(self.frame_start + GPU.FRAME_CLOCKS)
 
-                    self.interrupt_type |= 0b00010000
-                    self.interrupt_type |= self.mode
+        if clock >= self.lcd_interrupt:
+            self.memory.io[0x0F] |= 0x02
+
+        self.schedule()
+
+    # Finds the first CPU clock from the given one where the LCD interrupt is requested
+    def next_lcd_interrupt(self, clock):
+        status = self.memory.io[self.LCD_STATUS - 0xFF00]
+        position = clock - self.frame_start
+        times = []
+
+        # LY = LYC coincidence
+        if status & 0b01000000 and self.memory.io[self.LY_COMPARE - 0xFF00] < 154:
+            times.append(self.memory.io[self.LY_COMPARE - 0xFF00] * GPU.LINE_CLOCKS)
+
+        # Start of a line (OAM) and H-Blank, these only happen on the 144 drawn lines
+        for bit, offset in ((0b00100000, 0), (0b00001000, GPU.LINE_DRAWN_CLOCKS)):
+            if status & bit:
+                line = max(-(-(position - offset) // GPU.LINE_CLOCKS), 0)
+
+                times.append(line * GPU.LINE_CLOCKS + offset if line < 144 else GPU.FRAME_CLOCKS + offset)
+
+        times = [t if t >= position else t + GPU.FRAME_CLOCKS for t in times]
+
+        return self.frame_start + min(times) if times else GPU.NEVER
+
+    # Works out the next point at which update needs to be called
+    def schedule(self):
+        if not self.enabled:
+            self.lcd_interrupt = GPU.NEVER
+            self.next_event = GPU.NEVER
+            return
+
+        if self.vblank:
+            event = self.frame_start + GPU.FRAME_CLOCKS
+        else:
+            event = self.frame_start + GPU.VBLANK_CLOCKS
 
-                    self.memory.write(self.LCD_STATUS, self.interrupt_type)
-                    self.memory.write(self.LCD_Y_LINE, self.line)
\ No newline at end of file
+        self.lcd_interrupt = self.next_lcd_interrupt(self.cpu.clock + 1)
+        self.next_event = min(event, self.lcd_interrupt)
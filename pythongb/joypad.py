@@ -0,0 +1,73 @@
+"""
+The joypad, read by games at 0xFF00. The buttons held can be set straight away, or changes queued to happen when
+the CPU clock reaches a given point, so input can be fed in at exactly the same point in the emulation every run.
+Listeners are told each time the buttons held change, with the clock at which they changed.
+
+Queued changes are kept once they have happened, and the state arena holds how many had happened. Loading an earlier
+state, as run ahead, rewind and netplay do, makes the changes after it happen again as the emulation runs on.
+Restore listeners are told when that happens, with the clock and buttons held of the state loaded.
+"""
+
+NEVER = float("inf")
+
+
+class Joypad(object):
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.memory = cpu.memory
+
+        # Every change queued as (clock, buttons) in the order they happen, and how many of them have happened
+        self.events = []
+        self.position = 0
+
+        # The CPU clock at which update should next be called
+        self.next_event = NEVER
+
+        # Called with the clock and the buttons held each time they change
+        self.listeners = []
+
+        # Called with the clock and the buttons held when an earlier state is loaded
+        self.restore_listeners = []
+
+    def set_buttons(self, buttons):
+        self.apply(self.cpu.clock, buttons)
+
+    # Holds the buttons from when the CPU clock reaches clock, changes have to be queued in order
+    def queue(self, clock, buttons):
+        if self.events and clock < self.events[-1][0]:
+            raise ValueError("Joypad events must be queued in order")
+
+        self.events.append((clock, buttons))
+        self.next_event = self.events[self.position][0]
+
+    def clear(self):
+        self.events = []
+        self.position = 0
+        self.next_event = NEVER
+
+    # Called when the CPU clock reaches next_event, between instructions
+    def update(self):
+        events = self.events
+
+        while self.position < len(events) and events[self.position][0] <= self.cpu.clock:
+            self.apply(*events[self.position])
+            self.position += 1
+
+        self.next_event = events[self.position][0] if self.position < len(events) else NEVER
+
+    # Called by the state arena once a state is loaded, with how many queued changes had happened in it
+    def restore(self, position):
+        self.position = min(position, len(self.events))
+        self.next_event = self.events[self.position][0] if self.position < len(self.events) else NEVER
+
+        for listener in self.restore_listeners:
+            listener(self.cpu.clock, self.memory.buttons)
+
+    def apply(self, clock, buttons):
+        if buttons == self.memory.buttons:
+            return
+
+        self.memory.set_buttons(buttons)
+
+        for listener in self.listeners:
+            listener(clock, buttons)
@@ -1,4 +1,4 @@
-from datetime import datetime
+from .arena import StateArena
 
 """
 Memory Map
@@ -37,6 +37,22 @@ class MemoryController(object):
             0x78, 0x86, 0x23, 0x05, 0x20, 0xfb, 0x86, 0x20, 0xfe,
             0x3e, 0x01, 0xe0, 0x50]
 
+    # The bits of each button in the buttons held, the directions are the low 4 bits read from 0xFF00 and the
+    # others the high 4
+    BUTTONS = {
+        "right": 0x01,
+        "left": 0x02,
+        "up": 0x04,
+        "down": 0x08,
+        "a": 0x10,
+        "b": 0x20,
+        "select": 0x40,
+        "start": 0x80
+    }
+
+    # The CPU's clock speed, the RTC counts a second each time this many clocks go by
+    CLOCK_SPEED = 4194304
+
     def __init__(self, debug):
         self.debug = debug
         self.bios_use = True
@@ -45,7 +61,7 @@ class MemoryController(object):
         self.banking_type = 0
 
         # Select the bank in the ROM
-        self.curr_bank = 1
+        self.currBank = 1
 
         # 0 - 16Mbit ROM 8KByte RAM and 1 - Select 4Mbit ROM 32KByte RAM
         self.memory_model = 0
@@ -58,25 +74,39 @@ class MemoryController(object):
 
         self.latch_rtc = 0
 
-        # Time Registers
+        # Time Registers, as latched. Days is 9 bits, the top bit is also bit 0 of the flags
         self.seconds = 0
         self.minutes = 0
         self.hours = 0
         self.days = 0
         self.flags = 0
 
+        # The time register (0x08 - 0x0C) mapped to 0xA000 - 0xC000 while map_rtc is set
+        self.rtc_register = 0x08
+
+        # The RTC is worked out from the CPU clock, so it runs the same every time. The time in seconds is
+        # rtc_base + the seconds the CPU has run for, or rtc_stopped while the RTC is halted (bit 6 of the flags)
+        self.rtc_base = 0
+        self.rtc_halted = False
+        self.rtc_stopped = 0
+
+        # CPU and GPU References (Empty until attached)
+        self.cpu = None
+        self.gpu = None
+
         self.rom = bytearray(0x8000)  # 0x0000 - 0x8000 (Override with game rom)
-        self.vram = bytearray(0xA000 - 0x8000)  # 0x8000 - 0xA000
-        self.eram = bytearray((0xC000 - 0xA000) + 0x2000 * 0x0F)  # 0xA000 - 0xC000 (Extra if the eram is banked)
-        self.wram = bytearray(0xE000 - 0xC000)  # 0xC000 - 0xE000 Echoed to: 0xE000 - 0xFE00
-        self.oam = bytearray(0xFEA0 - 0xFE00)  # 0xFE00 - 0xFEA0
+
+        # The rest of the memory is made of views into one buffer holding the whole state, see arena.py
+        self.arena = None
+        self.set_state_buffer(None)
+
         # 0xFEA0 - 0xFF00 Unused
-        self.io = bytearray(0xFF4C - 0xFF00)  # 0xFF00- 0xFF4C
         # 0xFF4C - 0xFF80 is empty
-        self.ram = bytearray(0xFFFF - 0xFF80)  # 0xFF80 - 0xFFFF
+        self.interrupt_enable = 0  # 0xFFFF
+
+        # The buttons held down, one bit for each in BUTTONS
+        self.buttons = 0
 
-        # GPU Reference (Empty until attached)
-        self.gpu = None
 
     def read0(self, loc):
         # At the start of the emulation the bios is in use
@@ -109,11 +139,13 @@ class MemoryController(object):
         elif loc < 0xFF00:
             return 0x0
         elif loc < 0xFF4C:
-            return self.io[loc - 0xFF00]
+            return self.read_io(loc)
         elif loc < 0xFF80:
             return 0x0
         elif loc < 0xFFFF:
             return self.ram[loc - 0xFF80]
+        elif loc == 0xFFFF:
+            return self.interrupt_enable
 
         return 0
 
@@ -143,9 +175,11 @@ class MemoryController(object):
         elif loc < 0xFEA0:
             return self.oam[loc - 0xFE00]
         elif loc < 0xFF4C:
-            return self.io[loc - 0xFF00]
+            return self.read_io(loc)
         elif loc < 0xFFFF:
             return self.ram[loc - 0xFF80]
+        elif loc == 0xFFFF:
+            return self.interrupt_enable
 
         return 0
 
@@ -176,9 +210,11 @@ class MemoryController(object):
         elif loc < 0xFEA0:
             return self.oam[loc - 0xFE00]
         elif loc < 0xFF4C:
-            return self.io[loc - 0xFF00]
+            return self.read_io(loc)
         elif loc < 0xFFFF:
             return self.ram[loc - 0xFF80]
+        elif loc == 0xFFFF:
+            return self.interrupt_enable
 
         return 0
 
@@ -205,8 +241,7 @@ class MemoryController(object):
                 if not self.map_rtc:
                     return self.eram[loc - 0xA000 + (0x2000 * self.eram_bank)]
                 else:
-                    # TODO: Implement the register mappings
-                    pass
+                    return self.read_rtc()
         elif loc < 0xE000:
             return self.wram[loc - 0xC000]
         elif loc < 0xFE00:
@@ -214,9 +249,11 @@ class MemoryController(object):
         elif loc < 0xFEA0:
             return self.oam[loc - 0xFE00]
         elif loc < 0xFF4C:
-            return self.io[loc - 0xFF00]
+            return self.read_io(loc)
         elif loc < 0xFFFF:
             return self.ram[loc - 0xFF80]
+        elif loc == 0xFFFF:
+            return self.interrupt_enable
 
         return 0
 
@@ -247,9 +284,11 @@ class MemoryController(object):
         elif loc < 0xFEA0:
             return self.oam[loc - 0xFE00]
         elif loc < 0xFF4C:
-            return self.io[loc - 0xFF00]
+            return self.read_io(loc)
         elif loc < 0xFFFF:
             return self.ram[loc - 0xFF80]
+        elif loc == 0xFFFF:
+            return self.interrupt_enable
 
         return 0
 
@@ -266,15 +305,11 @@ class MemoryController(object):
 
     # ROM Only Banking
     def write0(self, loc, data):
-        # This is for selecting the appropriate bank
+        # The ROM can't be written to, without a memory bank controller there is nothing to select
         if loc < 0x8000:
-            self.rom[loc] = data
-        elif loc < 0x9800:
-            # Update the tile data
-            self.gpu.update_tiles(loc)
-            self.vram[loc - 0x8000] = data
+            pass
         elif loc < 0xA000:
-            self.vram[loc - 0x8000] = data
+            self.write_vram(loc, data)
         elif loc < 0xC000:
             self.eram[loc - 0xA000 + (0x2000 * self.eram_bank)] = data
         elif loc < 0xE000:
@@ -282,11 +317,13 @@ class MemoryController(object):
         elif loc < 0xFE00:
             self.wram[loc - 0xE000] = data
         elif loc < 0xFEA0:
-            self.oam[loc - 0xFE00] = data
+            self.write_oam(loc, data)
         elif loc < 0xFF4C:
-            self.io[loc - 0xFF00] = data
+            self.write_io(loc, data)
         elif loc < 0xFFFF:
             self.ram[loc - 0xFF80] = data
+        elif loc == 0xFFFF:
+            self.interrupt_enable = data
 
     # MBC1 Banking
     def write1(self, loc, data):
@@ -321,11 +358,8 @@ class MemoryController(object):
             # Take the last bit and select the memory model
             self.memory_model = loc & 0x01
 
-        elif loc < 0x9800:
-            # Update the tile data
-            return self.vram[loc - 0x8000]
         elif loc < 0xA000:
-            self.vram[loc - 0x8000] = data
+            self.write_vram(loc, data)
         elif loc < 0xC000:
             # Holds the external ram available in the cart
             self.eram[loc - 0xA000 + (0x2000 * self.eram_bank)] = data
@@ -334,11 +368,13 @@ class MemoryController(object):
         elif loc < 0xFE00:
             self.wram[loc - 0xE000] = data
         elif loc < 0xFEA0:
-            self.oam[loc - 0xFE00] = data
+            self.write_oam(loc, data)
         elif loc < 0xFF4C:
-            self.io[loc - 0xFF00] = data
+            self.write_io(loc, data)
         elif loc < 0xFFFF:
             self.ram[loc - 0xFF80] = data
+        elif loc == 0xFFFF:
+            self.interrupt_enable = data
 
     # MBC2 Banking
     def write2(self, loc, data):
@@ -373,13 +409,8 @@ class MemoryController(object):
             # Take the last bit and select the memory model
             # self.memory_model = loc & 0x01
             pass
-        elif loc < 0x9800:
-            # Update the tile data
-            self.tiles_outdated = True
-            self.outdated_location = loc
-            return self.vram[loc - 0x8000]
         elif loc < 0xA000:
-            self.vram[loc - 0x8000] = data
+            self.write_vram(loc, data)
         elif loc < 0xC000:
             # Holds the external ram available in the cart
             self.eram[loc - 0xA000] = data
@@ -388,11 +419,13 @@ class MemoryController(object):
         elif loc < 0xFE00:
             self.wram[loc - 0xE000] = data
         elif loc < 0xFEA0:
-            self.oam[loc - 0xFE00] = data
+            self.write_oam(loc, data)
         elif loc < 0xFF4C:
-            self.io[loc - 0xFF00] = data
+            self.write_io(loc, data)
         elif loc < 0xFFFF:
             self.ram[loc - 0xFF80] = data
+        elif loc == 0xFFFF:
+            self.interrupt_enable = data
 
     # MBC3 Banking
     def write3(self, loc, data):
@@ -423,7 +456,8 @@ class MemoryController(object):
             if data <= 3:
                 self.eram_bank = data & 0x0F
                 self.map_rtc = False
-            else:
+            elif 0x08 <= data <= 0x0C:
+                self.rtc_register = data
                 self.map_rtc = True
 
         elif 0x6000 <= loc < 0x8000:
@@ -431,36 +465,31 @@ class MemoryController(object):
             if data == 0:
                 self.latch_rtc = 1
             elif data == 1:
-                self.latch_rtc = 2
+                if self.latch_rtc == 1:
+                    self.latch_time()
 
-                # Load the time from the OS clock
-                date = datetime.now()
-                self.seconds = date.second
-                self.minutes = date.minute
-                self.hours = date.hour
-                self.days = date.day
-
-        elif loc < 0x9800:
-            # Update the tile data
-            self.tiles_outdated = True
-            self.outdated_location = loc
-            return self.vram[loc - 0x8000]
+                self.latch_rtc = 2
 
         elif loc < 0xA000:
-            self.vram[loc - 0x8000] = data
+            self.write_vram(loc, data)
         elif loc < 0xC000:
-            # Holds the external ram available in the cart
-            self.eram[loc - 0xA000 + (0x2000 * self.eram_bank)] = data
+            if self.map_rtc:
+                self.write_rtc(data)
+            else:
+                # Holds the external ram available in the cart
+                self.eram[loc - 0xA000 + (0x2000 * self.eram_bank)] = data
         elif loc < 0xE000:
             self.wram[loc - 0xC000] = data
         elif loc < 0xFE00:
             self.wram[loc - 0xE000] = data
         elif loc < 0xFEA0:
-            self.oam[loc - 0xFE00] = data
+            self.write_oam(loc, data)
         elif loc < 0xFF4C:
-            self.io[loc - 0xFF00] = data
+            self.write_io(loc, data)
         elif loc < 0xFFFF:
             self.ram[loc - 0xFF80] = data
+        elif loc == 0xFFFF:
+            self.interrupt_enable = data
 
     # MBC5 Banking
     def write5(self, loc, data):
@@ -488,14 +517,8 @@ class MemoryController(object):
             # Take the last bit and select the memory model
             self.memory_model = loc & 0x01
 
-        elif loc < 0x9800:
-            # Update the tile data
-            self.tiles_outdated = True
-            self.outdated_location = loc
-            return self.vram[loc - 0x8000]
-
         elif loc < 0xA000:
-            self.vram[loc - 0x8000] = data
+            self.write_vram(loc, data)
         elif loc < 0xC000:
             # Holds the external ram available in the cart
             self.eram[loc - 0xA000 + (0x2000 * self.eram_bank)] = data
@@ -504,11 +527,170 @@ class MemoryController(object):
         elif loc < 0xFE00:
             self.wram[loc - 0xE000] = data
         elif loc < 0xFEA0:
-            self.oam[loc - 0xFE00] = data
+            self.write_oam(loc, data)
         elif loc < 0xFF4C:
-            self.io[loc - 0xFF00] = data
+            self.write_io(loc, data)
         elif loc < 0xFFFF:
             self.ram[loc - 0xFF80] = data
+        elif loc == 0xFFFF:
+            self.interrupt_enable = data
+
+    # The RTC's time in seconds
+    def rtc_time(self):
+        if self.rtc_halted:
+            return self.rtc_stopped
+
+        return self.rtc_base + self.cpu.clock // MemoryController.CLOCK_SPEED
+
+    # Sets the RTC's time in seconds, it carries on counting from there unless halted
+    def set_rtc_time(self, seconds):
+        if seconds < 0:
+            raise ValueError("The RTC's time can't be negative")
+
+        if self.rtc_halted:
+            self.rtc_stopped = seconds
+        else:
+            self.rtc_base = seconds - self.cpu.clock // MemoryController.CLOCK_SPEED
+
+    def latch_time(self):
+        time = self.rtc_time()
+
+        self.seconds = time % 60
+        self.minutes = time // 60 % 60
+        self.hours = time // 3600 % 24
+        self.days = time // 86400 % 512
+
+        # Bit 7 is the day counter carry, set once the days have gone past 511
+        self.flags = (self.flags & 0x80) | (0x80 if time // 86400 > 511 else 0)
+        self.flags |= (self.days >> 8) | (0x40 if self.rtc_halted else 0)
+
+    def read_rtc(self):
+        if self.rtc_register == 0x08:
+            return self.seconds
+        elif self.rtc_register == 0x09:
+            return self.minutes
+        elif self.rtc_register == 0x0A:
+            return self.hours
+        elif self.rtc_register == 0x0B:
+            return self.days & 0xFF
+
+        return self.flags
+
+    # Writing a time register sets that part of the running time, and the latched copy
+    def write_rtc(self, data):
+        time = self.rtc_time()
+        days = time // 86400 % 512
+
+        if self.rtc_register == 0x08:
+            self.seconds = data % 60
+            time += self.seconds - time % 60
+        elif self.rtc_register == 0x09:
+            self.minutes = data % 60
+            time += (self.minutes - time // 60 % 60) * 60
+        elif self.rtc_register == 0x0A:
+            self.hours = data % 24
+            time += (self.hours - time // 3600 % 24) * 3600
+        elif self.rtc_register == 0x0B:
+            self.days = (self.days & 0x100) | data
+            time += ((days & 0x100 | data) - days) * 86400
+        else:
+            self.flags = data & 0xC1
+            self.days = (self.days & 0xFF) | (data & 0x01) << 8
+            time += ((days & 0xFF | (data & 0x01) << 8) - days) * 86400
+
+            # Halting stops the time where it is, and carrying on starts it from there
+            self.rtc_halted = data & 0x40 != 0
+
+        self.set_rtc_time(time)
+
+    # True if an interrupt has been requested (0xFF0F) which is enabled (0xFFFF)
+    def interrupt_pending(self):
+        return self.io[0x0F] & self.interrupt_enable & 0x1F != 0
+
+    def read_io(self, loc):
+        # 0xFEA0 - 0xFF00 is unused
+        if loc < 0xFF00:
+            return 0
+
+        # The GPU works out the status and current line when they are needed
+        if loc == 0xFF41 or loc == 0xFF44:
+            return self.gpu.read_register(loc)
+
+        if loc == 0xFF00:
+            return self.read_joypad()
+
+        return self.io[loc - 0xFF00]
+
+    # Bits 4 and 5 written to 0xFF00 choose the directions or the other buttons, a button held reads as 0
+    def read_joypad(self):
+        select = self.io[0x00] & 0x30
+        held = 0
+
+        if not select & 0x10:
+            held |= self.buttons & 0x0F
+
+        if not select & 0x20:
+            held |= self.buttons >> 4
+
+        return 0xC0 | select | (~held & 0x0F)
+
+    # Sets the buttons held, a button being pressed requests the joypad interrupt
+    def set_buttons(self, buttons):
+        if buttons & ~self.buttons:
+            self.io[0x0F] |= 0x10
+
+        self.buttons = buttons
+
+    # Shared by every banking type, VRAM writes keep the GPU's decoded tiles in step
+    def write_vram(self, loc, data):
+        if self.vram[loc - 0x8000] == data:
+            return
+
+        # Lines before the write need to be drawn with the old data
+        self.gpu.catch_up()
+
+        self.vram[loc - 0x8000] = data
+        self.gpu.update_vram(loc)
+
+    # The GPU caches which sprites sit on each line, so let it know OAM has moved
+    def write_oam(self, loc, data):
+        if self.oam[loc - 0xFE00] != data:
+            self.gpu.catch_up()
+
+            self.oam[loc - 0xFE00] = data
+            self.gpu.update_oam(loc)
+
+    def write_io(self, loc, data):
+        # 0xFEA0 - 0xFF00 is unused
+        if loc < 0xFF00:
+            return
+
+        if loc >= 0xFF40:
+            self.gpu.catch_up()
+
+        self.io[loc - 0xFF00] = data
+
+        if loc == 0xFF46:
+            self.dma_transfer(data)
+        elif loc >= 0xFF40:
+            self.gpu.update_register(loc, data)
+
+    # Copy 0xA0 bytes from XX00 into the OAM, where XX is the value written to 0xFF46
+    def dma_transfer(self, data):
+        source = data << 8
+
+        if 0xC000 <= source < 0xDF60:
+            # Most games keep a shadow OAM in work RAM, so copy it in one go
+            oam = self.wram[source - 0xC000:source - 0xC000 + 0xA0]
+        else:
+            oam = bytes(self.read(source + i) for i in range(0xA0))
+
+        # Games copy the sprites every frame, even when they have not moved
+        if oam != self.oam:
+            self.gpu.catch_up()
+
+            self.oam[:] = oam
+            self.gpu.update_oam(0xFE00)
 
     def write(self, loc, data):
         # Map the bankingType to a dictionary function
@@ -537,7 +719,7 @@ class MemoryController(object):
         mbc0_values = [0x0, 0x8, 0x9, 0xB, 0xC, 0xD]
         mbc1_values = [0x1, 0x2, 0x3]
         mbc2_values = [0x5, 0x6]
-        mbc3_values = [0x12, 0x13]
+        mbc3_values = [0x0F, 0x10, 0x11, 0x12, 0x13]
         mbc5_values = [0x19, 0x1A, 0x1B, 0x1C, 0x1D, 0x1E]
 
         if cart_type in mbc0_values:
@@ -557,5 +739,27 @@ class MemoryController(object):
         # Place this in memory
         self.rom = rom_array
 
+    def attach_cpu(self, cpu):
+        self.cpu = cpu
+
     def attach_gpu(self, gpu):
         self.gpu = gpu
+
+    # Moves the memory into a new arena using buffer, such as shared memory, or a new bytearray if None
+    def set_state_buffer(self, buffer):
+        arena = StateArena(buffer)
+
+        if self.arena is not None:
+            arena.buffer[:] = self.arena.buffer
+
+        self.arena = arena
+
+        self.vram = arena.regions["vram"]  # 0x8000 - 0xA000
+        self.eram = arena.regions["eram"]  # 0xA000 - 0xC000 (Extra if the eram is banked)
+        self.wram = arena.regions["wram"]  # 0xC000 - 0xE000 Echoed to: 0xE000 - 0xFE00
+        self.oam = arena.regions["oam"]  # 0xFE00 - 0xFEA0
+        self.io = arena.regions["io"]  # 0xFF00- 0xFF4C
+        self.ram = arena.regions["ram"]  # 0xFF80 - 0xFFFF
+
+        if self.gpu is not None:
+            self.gpu.map_memory()
@@ -0,0 +1,165 @@
+import argparse
+import struct
+import time
+import zlib
+
+"""
+Records the buttons held into a movie, which plays back the same every time. A movie holds the state it started
+from and each change to the buttons with the number of CPU clocks since the change before, so it only grows when
+the buttons change. The last change is the clock the recording ended at, with the buttons unchanged.
+
+When an earlier state is loaded while recording, as by run ahead, rewind or a netplay rollback, the changes from the
+clock of that state on are taken back out of the movie, so it holds what the emulation finally ran with.
+
+Format
+------------
+Magic b"PGBM", Version (uint32), Length of the start state (uint32), then the start state compressed with zlib.
+Then for each change: Clocks since the last change or the start (uint32), Buttons held (uint8)
+"""
+
+MAGIC = b"PGBM"
+VERSION = 1
+
+HEADER = struct.Struct("<4sII")
+EVENT = struct.Struct("<IB")
+
+MAX_GAP = 0xFFFFFFFF
+
+
+class MovieRecorder(object):
+    def __init__(self, gameboy, path):
+        self.gameboy = gameboy
+        self.path = path
+
+        arena = gameboy.cpu.memory.arena
+        arena.store(gameboy)
+        state = zlib.compress(arena.buffer)
+
+        self.stream = open(path, "wb")
+        self.stream.write(HEADER.pack(MAGIC, VERSION, len(state)))
+        self.stream.write(state)
+
+        self.clock = gameboy.cpu.clock
+        self.buttons = gameboy.cpu.memory.buttons
+        self.events = 0
+
+        # For each change written as (clock, where it starts in the file, the clock and buttons before it)
+        self.changes = []
+
+        gameboy.joypad.listeners.append(self.on_buttons)
+        gameboy.joypad.restore_listeners.append(self.on_restore)
+
+    def on_buttons(self, clock, buttons):
+        self.take_back(lambda change: change > clock)
+        self.write(clock, buttons)
+
+    # The emulation has gone back to clock, so the changes from then on didn't happen
+    def on_restore(self, clock, buttons):
+        self.take_back(lambda change: change >= clock)
+
+        if buttons != self.buttons:
+            self.write(clock, buttons)
+
+    def take_back(self, later):
+        while self.changes and later(self.changes[-1][0]):
+            clock, offset, self.clock, self.buttons = self.changes.pop()
+
+            self.stream.seek(offset)
+            self.stream.truncate()
+            self.events -= 1
+
+    def write(self, clock, buttons):
+        self.changes.append((clock, self.stream.tell(), self.clock, self.buttons))
+
+        # Long gaps are split by changes to the buttons already held
+        while clock - self.clock > MAX_GAP:
+            self.stream.write(EVENT.pack(MAX_GAP, self.buttons))
+            self.clock += MAX_GAP
+
+        self.stream.write(EVENT.pack(clock - self.clock, buttons))
+
+        self.clock = clock
+        self.buttons = buttons
+        self.events += 1
+
+    # Marks the end of the movie at the current clock and closes it
+    def close(self):
+        self.gameboy.joypad.listeners.remove(self.on_buttons)
+        self.gameboy.joypad.restore_listeners.remove(self.on_restore)
+
+        self.write(self.gameboy.cpu.clock, self.buttons)
+        self.stream.close()
+
+
+# Reads a movie, giving the start state and a list of (clock, buttons) changes
+def read_movie(path):
+    with open(path, "rb") as stream:
+        data = stream.read()
+
+    magic, version, length = HEADER.unpack_from(data, 0)
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a pythongb movie: " + str(path))
+
+    start = HEADER.size + length
+    state = zlib.decompress(data[HEADER.size:start])
+
+    return state, list(EVENT.iter_unpack(data[start:]))
+
+
+# Loads the start of the movie into the GameBoy and runs it to the end as fast as it can, drawing 1 of every
+# render_every frames. Returns the number of frames run
+def play_movie(gameboy, path, render_every=1):
+    state, events = read_movie(path)
+
+    arena = gameboy.cpu.memory.arena
+    arena.load(state)
+    arena.restore(gameboy)
+
+    joypad = gameboy.joypad
+    joypad.clear()
+
+    clock = gameboy.cpu.clock
+
+    for gap, buttons in events:
+        clock += gap
+        joypad.queue(clock, buttons)
+
+    frame_skip = gameboy.gpu.frame_skip
+    gameboy.gpu.set_frame_skip(render_every)
+
+    frames = 0
+
+    try:
+        while gameboy.cpu.clock < clock:
+            gameboy.run_frame()
+            frames += 1
+    finally:
+        gameboy.gpu.set_frame_skip(frame_skip)
+
+    return frames
+
+
+# Plays a movie without a display and reports how fast it ran
+def main(args=None):
+    from .gb import GameBoy
+
+    parser = argparse.ArgumentParser(description="Plays a pythongb movie back as fast as possible")
+    parser.add_argument("rom")
+    parser.add_argument("movie")
+    parser.add_argument("--render-every", type=int, default=1, help="Draw 1 of every this many frames")
+
+    args = parser.parse_args(args)
+
+    gameboy = GameBoy()
+    gameboy.load_rom(args.rom)
+
+    start = time.perf_counter()
+    frames = play_movie(gameboy, args.movie, args.render_every)
+    elapsed = time.perf_counter() - start
+
+    print("%d frames in %.2fs, %.1f frames a second" % (frames, elapsed, frames / max(elapsed, 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import select
+import socket
+import struct
+import time
+
+"""
+Two players sharing a game, each running their own GameBoy and sending only the buttons they hold. Both GameBoys run
+the same game, and on each frame the buttons held by either player are pressed. A player doesn't wait for the other's
+buttons, it guesses they are the same as the last ones received and carries on. When buttons arrive which differ
+from the guess, the state from the start of that frame is loaded and the frames since are run again with them, so
+the two GameBoys end up in the same state without either waiting on the other.
+
+Message
+------------
+Frame (uint32), Buttons held (uint8)
+"""
+
+MESSAGE = struct.Struct("<IB")
+
+
+class NetplaySession(object):
+    # The connection is a connected socket to the other player. A player gets at most max_rollback frames ahead of
+    # the buttons received, past that it waits for them, for up to timeout seconds without any arriving
+    def __init__(self, gameboy, connection, max_rollback=8, timeout=5.0):
+        self.gameboy = gameboy
+        self.connection = connection
+        self.connection.setblocking(False)
+
+        self.max_rollback = max_rollback
+        self.timeout = timeout
+
+        # The next frame to run
+        self.frame = 0
+
+        # The buttons of each frame, the other player's guessed ones, and the snapshots from the start of each frame
+        # not yet confirmed
+        self.local = {}
+        self.remote = {}
+        self.guessed = {}
+        self.snapshots = {}
+
+        # The last frame received from the other player, and the buttons from it
+        self.confirmed = -1
+        self.remote_buttons = 0
+
+        # The earliest frame run with a wrong guess
+        self.mispredicted = None
+
+        self.received = bytearray()
+
+        # Counts the frames run again after a wrong guess
+        self.rollback_frames = 0
+
+    def send(self, frame, buttons):
+        self.connection.setblocking(True)
+
+        try:
+            self.connection.sendall(MESSAGE.pack(frame, buttons))
+        finally:
+            self.connection.setblocking(False)
+
+    # Takes in the messages which have arrived, waiting up to timeout for one if it isn't 0
+    def receive(self, timeout=0):
+        if timeout and not select.select([self.connection], [], [], timeout)[0]:
+            return
+
+        while True:
+            try:
+                data = self.connection.recv(4096)
+            except (BlockingIOError, InterruptedError):
+                break
+
+            if not data:
+                raise EOFError("The other player has gone")
+
+            self.received += data
+
+        messages = len(self.received) // MESSAGE.size
+
+        for frame, buttons in MESSAGE.iter_unpack(bytes(self.received[:messages * MESSAGE.size])):
+            self.remote[frame] = buttons
+            self.confirmed = frame
+            self.remote_buttons = buttons
+
+            if frame in self.guessed and self.guessed[frame] != buttons:
+                if self.mispredicted is None or frame < self.mispredicted:
+                    self.mispredicted = frame
+
+        del self.received[:messages * MESSAGE.size]
+
+    # Runs one frame, from the snapshot taken at its start
+    def run(self, frame, hooks=True):
+        arena = self.gameboy.cpu.memory.arena
+        arena.store(self.gameboy)
+        self.snapshots[frame] = arena.snapshot()
+
+        if frame in self.remote:
+            remote = self.remote[frame]
+            self.guessed.pop(frame, None)
+        else:
+            remote = self.guessed[frame] = self.remote_buttons
+
+        self.gameboy.joypad.set_buttons(self.local[frame] | remote)
+
+        if hooks:
+            self.gameboy.run_frame()
+        else:
+            self.gameboy.advance_frame()
+
+    # Loads the state from the first wrong guess and runs the frames since with the buttons received
+    def roll_back(self):
+        start = self.mispredicted
+        self.mispredicted = None
+
+        if start is None:
+            return
+
+        arena = self.gameboy.cpu.memory.arena
+        arena.load(self.snapshots[start])
+        arena.restore(self.gameboy)
+
+        # The frames run again have already been shown
+        self.gameboy.gpu.skip_frames(self.frame - start)
+
+        for frame in range(start, self.frame):
+            self.run(frame, hooks=False)
+
+        self.rollback_frames += self.frame - start
+
+    # Runs the next frame with the buttons held here, returning the frame drawn
+    def advance(self, buttons):
+        frame = self.frame
+
+        self.local[frame] = buttons
+        self.send(frame, buttons)
+
+        self.receive()
+
+        # Too far ahead of the other player to roll back, so wait for them
+        self.wait_for(frame - self.max_rollback, self.timeout)
+
+        self.roll_back()
+        self.run(frame)
+
+        self.frame += 1
+        self.forget(min(self.confirmed, self.frame - 1))
+
+        return self.gameboy.gpu.latest_frame()
+
+    # Nothing before the last confirmed frame can be rolled back to
+    def forget(self, confirmed):
+        for frames in (self.local, self.remote, self.guessed, self.snapshots):
+            for frame in [frame for frame in frames if frame < confirmed]:
+                del frames[frame]
+
+    # Waits until the other player's buttons up to frame have arrived. Raises TimeoutError if none arrive for timeout
+    # seconds, as when the other player has stopped
+    def wait_for(self, frame, timeout):
+        deadline = time.monotonic() + timeout
+
+        while self.confirmed < frame:
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                raise TimeoutError("No buttons from the other player")
+
+            before = self.confirmed
+            self.receive(timeout=remaining)
+
+            if self.confirmed != before:
+                deadline = time.monotonic() + timeout
+
+    # Waits for the other player's buttons for every frame run, and fixes any wrong guesses
+    def synchronise(self, timeout=5.0):
+        self.wait_for(self.frame - 1, timeout)
+        self.roll_back()
+
+    def close(self):
+        self.connection.close()
+
+
+# Two sessions connected to each other in this process, one using gameboy and the other a fork of it. This stands in
+# for the other player when testing
+def local_pair(gameboy, max_rollback=8, timeout=5.0):
+    a, b = socket.socketpair()
+
+    return (NetplaySession(gameboy, a, max_rollback, timeout),
+            NetplaySession(gameboy.fork(), b, max_rollback, timeout))
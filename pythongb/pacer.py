@@ -0,0 +1,53 @@
+import time
+
+"""
+Keeps the emulation running at the GameBoy's frame rate. Each frame has a deadline worked out from the first one,
+so time lost to a late wake up is made up on the next frame instead of adding up. When the host falls behind the
+pacer asks for frames to be skipped, these are emulated but not drawn.
+"""
+
+
+class FramePacer(object):
+    # The CPU runs at 4194304Hz and a frame takes 70224 clocks, ~59.73Hz
+    FRAME_RATE = 4194304 / 70224.0
+
+    # The clock and sleep default to the host's, they can be replaced to drive the pacer in tests
+    def __init__(self, frame_rate=FRAME_RATE, max_skip=4, clock=time.perf_counter, sleep=time.sleep):
+        self.frame_time = 1.0 / frame_rate
+
+        self.clock = clock
+        self.sleep = sleep
+
+        # The most frames in a row which will be skipped, past this the emulation is allowed to slow down
+        self.max_skip = max_skip
+
+        # The time at which the next frame should be finished
+        self.deadline = None
+
+        self.reset()
+
+    # Starts timing again from now, used when starting or after the emulation has been paused or in turbo mode
+    def reset(self):
+        self.deadline = self.clock() + self.frame_time
+
+    # Called when a frame is finished. Sleeps until it is due and returns the number of frames to skip drawing
+    def wait(self):
+        now = self.clock()
+        delay = self.deadline - now
+
+        if delay > 0:
+            self.sleep(delay)
+
+            self.deadline += self.frame_time
+            return 0
+
+        behind = int(-delay / self.frame_time)
+
+        if behind > self.max_skip:
+            # Too far behind to catch up, so give up on the lost time rather than skipping forever
+            self.deadline = now + self.frame_time
+            return self.max_skip
+
+        # Skip drawing a frame for each whole frame behind, these run faster and catch the time up
+        self.deadline += self.frame_time
+        return behind
@@ -0,0 +1,214 @@
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+from .scalers import get_scaler
+
+"""
+Records the frames drawn by the GPU. Frames are copied (23KB of shades) and handed to a background thread, which
+does the encoding and writing so the emulation only pays for the copy. Frames the same as the last one recorded
+are not queued, they make the last frame last longer instead.
+
+Formats
+------------
+raw - A header of b"PGBR" and the version (uint32), then for each frame its frame number (uint64) and the
+      (144, 160) uint8 map of shades
+png - A directory of frame_XXXXXXXX.png files with the shades as the palette, numbered by frame number
+gif - An animated GIF. The frames are kept in memory until the recorder is closed, so at most max_gif_frames
+      different frames can be recorded, past that recording raises ValueError
+
+PNG and GIF recordings can be scaled by one of the scalers in scalers.py, which is done on the writer thread. If
+writing fails the writer thread stops, and the error is raised by the next frame recorded or by close
+"""
+
+RAW_MAGIC = b"PGBR"
+RAW_VERSION = 1
+
+RAW_HEADER = struct.Struct("<4sI")
+RAW_FRAME = struct.Struct("<Q")
+
+FORMATS = ["raw", "png", "gif"]
+
+# A minute of frames at the GameBoy's frame rate
+MAX_GIF_FRAMES = 3600
+
+
+class FrameRecorder(object):
+    # The policy says what happens when the queue is full: "block" waits for the writer, "drop" loses the frame
+    def __init__(self, gpu, path, format="raw", queue_size=64, policy="block", scale=None,
+                 max_gif_frames=MAX_GIF_FRAMES):
+        if format not in FORMATS:
+            raise ValueError("Unknown recording format: " + str(format))
+
+        if scale is not None and format == "raw":
+            raise ValueError("Raw recordings can't be scaled")
+
+        if policy not in ("block", "drop"):
+            raise ValueError("Unknown queue policy: " + str(policy))
+
+        self.gpu = gpu
+        self.path = path
+        self.format = format
+        self.policy = policy
+
+        self.palette = [value for i in range(4) for value in gpu.palette_map[i]]
+        self.scaler = get_scaler(scale) if scale is not None else None
+        self.max_gif_frames = max_gif_frames
+
+        # The last frame queued, and counts of the frames recorded, repeated and dropped
+        self.last = None
+        self.recorded = 0
+        self.duplicates = 0
+        self.dropped = 0
+
+        self.queue = queue.Queue(queue_size)
+
+        # The exception the writer thread stopped with
+        self.error = None
+
+        self.writer = threading.Thread(target=self.write_frames, name="pythongb-recorder")
+        self.writer.daemon = True
+        self.writer.start()
+
+        gpu.frame_listeners.append(self.on_frame)
+
+    def on_frame(self, gpu):
+        frame = gpu.latest_frame()
+
+        if gpu.frame_unchanged or (self.last is not None and np.array_equal(frame, self.last)):
+            self.duplicates += 1
+            return
+
+        if self.format == "gif" and self.recorded >= self.max_gif_frames:
+            raise ValueError("GIF recordings are limited to %d frames" % self.max_gif_frames)
+
+        # The GPU will draw into this map again, so the writer needs its own copy
+        frame = frame.copy()
+
+        if self.policy == "block":
+            self.put((gpu.frame_number, frame))
+        else:
+            self.check_writer()
+
+            try:
+                self.queue.put_nowait((gpu.frame_number, frame))
+            except queue.Full:
+                self.dropped += 1
+                return
+
+        self.last = frame
+        self.recorded += 1
+
+    # Raises the error the writer thread stopped with, nothing would take the frames from the queue
+    def check_writer(self):
+        if self.error is not None:
+            raise self.error
+
+        if not self.writer.is_alive():
+            raise RuntimeError("The recorder's writer thread has stopped")
+
+    # Waits for room in the queue, as long as the writer is still taking from it
+    def put(self, item):
+        while True:
+            self.check_writer()
+
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    # Runs on the writer thread until None is queued
+    def write_frames(self):
+        writer = getattr(self, "write_" + self.format)
+
+        try:
+            writer()
+        except Exception as error:
+            self.error = error
+
+    def frames(self):
+        while True:
+            item = self.queue.get()
+
+            if item is None:
+                return
+
+            yield item
+
+    def write_raw(self):
+        with open(self.path, "wb") as stream:
+            stream.write(RAW_HEADER.pack(RAW_MAGIC, RAW_VERSION))
+
+            for frame_number, frame in self.frames():
+                stream.write(RAW_FRAME.pack(frame_number))
+                stream.write(frame.tobytes())
+
+    def image(self, frame):
+        from PIL import Image
+
+        if self.scaler is not None:
+            frame = self.scaler(frame)
+
+        image = Image.frombytes("P", (frame.shape[1], frame.shape[0]), frame.tobytes())
+        image.putpalette(self.palette)
+
+        return image
+
+    def write_png(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        for frame_number, frame in self.frames():
+            self.image(frame).save(os.path.join(self.path, "frame_%08d.png" % frame_number))
+
+    def write_gif(self):
+        images = []
+        frame_numbers = []
+
+        for frame_number, frame in self.frames():
+            images.append(self.image(frame))
+            frame_numbers.append(frame_number)
+
+        if not images:
+            return
+
+        # Each frame is shown until the next one recorded, the last for a single frame
+        frame_time = 1000 * 70224 / 4194304.0
+        frame_numbers.append(frame_numbers[-1] + 1)
+        durations = [int(round((b - a) * frame_time)) for a, b in zip(frame_numbers, frame_numbers[1:])]
+
+        images[0].save(self.path, format="GIF", save_all=True, append_images=images[1:], duration=durations, loop=0)
+
+    # Stops recording and waits for the frames queued to be written
+    def close(self):
+        if self.on_frame in self.gpu.frame_listeners:
+            self.gpu.frame_listeners.remove(self.on_frame)
+
+        self.put(None)
+        self.writer.join()
+
+        if self.error is not None:
+            raise self.error
+
+
+# Reads a raw recording, giving the frame number and frame of each frame recorded
+def read_raw(path):
+    with open(path, "rb") as stream:
+        magic, version = RAW_HEADER.unpack(stream.read(RAW_HEADER.size))
+
+        if magic != RAW_MAGIC or version != RAW_VERSION:
+            raise ValueError("Not a pythongb recording: " + str(path))
+
+        while True:
+            header = stream.read(RAW_FRAME.size)
+
+            if len(header) < RAW_FRAME.size:
+                return
+
+            frame = np.frombuffer(stream.read(144 * 160), np.uint8).reshape(144, 160)
+
+            yield RAW_FRAME.unpack(header)[0], frame
@@ -0,0 +1,68 @@
+import importlib
+
+import numpy as np
+
+"""
+Renderers take the frames from the GPU and show or store them. Each one is given the frames of shades that
+changed with draw(frame). Only the null and array renderers are loaded with the core, the others are imported
+when they are asked for so the emulator can run without a display, Pillow or OpenGL.
+"""
+
+
+# Does nothing with the frames, for running without any output
+class NullRenderer(object):
+    interactive = False
+
+    def __init__(self, gpu):
+        self.gpu = gpu
+
+    def draw(self, frame):
+        pass
+
+
+# Keeps the last frame as an RGB array
+class ArrayRenderer(object):
+    interactive = False
+
+    def __init__(self, gpu):
+        self.gpu = gpu
+
+        self.palette = np.array([gpu.palette_map[i] for i in range(4)], np.uint8)
+        self.image = np.zeros((144, 160, 3), np.uint8)
+
+    def draw(self, frame):
+        np.take(self.palette, frame, axis=0, out=self.image)
+
+
+# Keeps the last frame as a PIL image, with the palette as the image's palette
+class PILRenderer(object):
+    interactive = False
+
+    def __init__(self, gpu):
+        from PIL import Image
+
+        self.gpu = gpu
+
+        self.image = Image.new("P", (160, 144))
+        self.image.putpalette([value for i in range(4) for value in gpu.palette_map[i]])
+
+    def draw(self, frame):
+        self.image.frombytes(frame.tobytes())
+
+
+# Maps the name of a renderer to the module and class it is in
+RENDERERS = {
+    "null": ("pythongb.renderers", "NullRenderer"),
+    "array": ("pythongb.renderers", "ArrayRenderer"),
+    "pil": ("pythongb.renderers", "PILRenderer"),
+    "vispy": ("pythongb.display", "VispyRenderer")
+}
+
+
+def get_renderer(name, gpu):
+    if name not in RENDERERS:
+        raise ValueError("Unknown renderer: " + str(name))
+
+    module, renderer = RENDERERS[name]
+
+    return getattr(importlib.import_module(module), renderer)(gpu)
@@ -0,0 +1,175 @@
+import collections
+import itertools
+import queue
+import threading
+import zlib
+
+import numpy as np
+
+"""
+Keeps snapshots of a GameBoy's state so the emulation can be taken back. A snapshot is taken every interval frames,
+which costs the emulation a store and one copy of the arena. A background thread XORs each snapshot with the one
+before, which leaves mostly zeros, and compresses it. Every keyframe_interval snapshots a whole compressed state is
+kept instead, so a snapshot is rebuilt from at most keyframe_interval pieces.
+
+The snapshots are kept until they use more than max_bytes, then the oldest keyframe and the deltas after it are
+thrown away together. Rewinding loads the newest snapshot at or before the frame wanted and emulates forward to it.
+"""
+
+
+class RewindBuffer(object):
+    def __init__(self, gameboy, interval=10, max_bytes=16 * 1024 * 1024, keyframe_interval=30, queue_size=8):
+        self.gameboy = gameboy
+
+        self.interval = max(int(interval), 1)
+        self.max_bytes = max_bytes
+        self.keyframe_interval = max(int(keyframe_interval), 1)
+
+        # Counts the frames run, this is what snapshots are numbered by
+        self.frame = 0
+
+        # The compressed snapshots as (frame, keyframe, data), oldest first, and their size
+        self.snapshots = collections.deque()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        # The last state compressed, deltas are made against it. Cleared to start again with a keyframe
+        self.previous = None
+        self.deltas = 0
+
+        self.queue = queue.Queue(queue_size)
+
+        self.compressor = threading.Thread(target=self.compress_snapshots, name="pythongb-rewind")
+        self.compressor.daemon = True
+        self.compressor.start()
+
+        gameboy.frame_hooks.append(self.on_frame)
+
+    # Called by the GameBoy at the end of each frame, between instructions
+    def on_frame(self, gameboy):
+        self.frame += 1
+
+        if self.frame % self.interval == 0:
+            arena = gameboy.cpu.memory.arena
+            arena.store(gameboy)
+
+            self.queue.put((self.frame, arena.snapshot()))
+
+    # Runs on the compressor thread until None is queued
+    def compress_snapshots(self):
+        while True:
+            item = self.queue.get()
+
+            if item is None:
+                self.queue.task_done()
+                return
+
+            frame, state = item
+            state = np.frombuffer(state, np.uint8)
+
+            keyframe = self.previous is None or self.deltas + 1 >= self.keyframe_interval
+
+            if keyframe:
+                data = zlib.compress(state, 1)
+                self.deltas = 0
+            else:
+                data = zlib.compress(state ^ self.previous, 1)
+                self.deltas += 1
+
+            self.previous = state
+
+            with self.lock:
+                self.snapshots.append((frame, keyframe, data))
+                self.size += len(data)
+
+                # Throw away whole runs of a keyframe and its deltas, the deltas are no use without it. The run still
+                # being added to is kept, and when it is all that is left the next snapshot starts a new one, so the
+                # deltas always have their keyframe
+                while self.size > self.max_bytes:
+                    if not any(snapshot[1] for snapshot in itertools.islice(self.snapshots, 1, None)):
+                        self.previous = None
+                        break
+
+                    self.drop_oldest()
+
+                    while not self.snapshots[0][1]:
+                        self.drop_oldest()
+
+            self.queue.task_done()
+
+    def drop_oldest(self):
+        self.size -= len(self.snapshots.popleft()[2])
+
+    # The frames which can be rewound to without emulating, oldest first
+    def frames(self):
+        self.queue.join()
+
+        with self.lock:
+            return [frame for frame, keyframe, data in self.snapshots]
+
+    # Rebuilds the newest state at or before frame, returning its frame and the state
+    def find(self, frame):
+        with self.lock:
+            snapshots = [snapshot for snapshot in self.snapshots if snapshot[0] <= frame]
+
+        if not snapshots:
+            return None, None
+
+        start = max(i for i, snapshot in enumerate(snapshots) if snapshot[1])
+        state = np.frombuffer(zlib.decompress(snapshots[start][2]), np.uint8).copy()
+
+        for snapshot in snapshots[start + 1:]:
+            state ^= np.frombuffer(zlib.decompress(snapshot[2]), np.uint8)
+
+        return snapshots[-1][0], state
+
+    # Takes the emulation back the given number of frames. Call this between frames, from the emulation thread or
+    # while it is paused. Returns the number of frames gone back, less than asked if the snapshots don't go back far
+    # enough
+    def rewind(self, frames):
+        self.queue.join()
+
+        target = max(self.frame - frames, 0)
+        frame, state = self.find(target)
+
+        if frame is None:
+            with self.lock:
+                if not self.snapshots:
+                    return 0
+
+                frame, keyframe, data = self.snapshots[0]
+
+            target = frame
+            frame, state = self.find(frame)
+
+        # The snapshots after this one are from a future which won't happen now
+        with self.lock:
+            while self.snapshots and self.snapshots[-1][0] > frame:
+                self.size -= len(self.snapshots.pop()[2])
+
+        # The compressor has finished, so the next snapshot can start from a keyframe
+        self.previous = None
+
+        gone_back = self.frame - target
+
+        arena = self.gameboy.cpu.memory.arena
+        arena.load(state)
+        arena.restore(self.gameboy)
+
+        self.frame = frame
+
+        # Only the frame rewound to needs drawing
+        self.gameboy.gpu.skip_frames(max(target - frame - 1, 0))
+
+        while self.frame < target:
+            self.gameboy.run_frame()
+
+        return gone_back
+
+    # Stops taking snapshots and waits for the compressor to finish
+    def close(self):
+        if self.on_frame in self.gameboy.frame_hooks:
+            self.gameboy.frame_hooks.remove(self.on_frame)
+
+        self.queue.put(None)
+        self.compressor.join()
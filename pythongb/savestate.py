@@ -0,0 +1,55 @@
+import mmap
+
+from .arena import STATE_SIZE
+
+"""
+Saves the state of a GameBoy to bytes or a file, and loads it back. The state is the MemoryController's arena, see
+arena.py for the layout, so saving is a store and one copy out of the arena, and loading one copy in and a restore.
+A state can only be loaded into a GameBoy with the same ROM loaded.
+"""
+
+
+# Writes the state of the GameBoy into buffer, which can be anything writable of at least STATE_SIZE bytes
+def pack_state(gameboy, buffer):
+    arena = gameboy.cpu.memory.arena
+    arena.store(gameboy)
+
+    buffer = memoryview(buffer).cast("B")
+    buffer[:STATE_SIZE] = arena.buffer
+
+    return buffer
+
+
+# Loads a state written by pack_state from anything readable, bytes, a bytearray or an mmap
+def unpack_state(gameboy, buffer):
+    arena = gameboy.cpu.memory.arena
+
+    arena.load(buffer)
+    arena.restore(gameboy)
+
+
+# Saves the state to a new bytearray, or to a file if a path is given
+def save_state(gameboy, path=None):
+    state = bytearray(STATE_SIZE)
+    pack_state(gameboy, state)
+
+    if path is not None:
+        with open(path, "wb") as stream:
+            stream.write(state)
+
+    return state
+
+
+# Loads a state from a buffer, or from the path of a file which is mapped rather than read
+def load_state(gameboy, state):
+    if not isinstance(state, str):
+        unpack_state(gameboy, state)
+        return
+
+    with open(state, "rb") as stream:
+        mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        unpack_state(gameboy, mapped)
+    finally:
+        mapped.close()
@@ -0,0 +1,91 @@
+import numpy as np
+
+"""
+Scales frames of shades for the recorder and viewers. Each scaler works on the whole frame at once and writes into
+an output array made when it is created, so scaling a frame makes no new arrays beyond NumPy's temporaries.
+
+nearest2, nearest3, nearest4 - Each pixel becomes a 2x2, 3x3 or 4x4 block
+scale2x - EPX/Scale2x, which rounds off diagonal edges
+scale4x - Scale2x applied twice
+"""
+
+
+class NearestScaler(object):
+    def __init__(self, factor, shape=(144, 160), dtype=np.uint8):
+        self.factor = factor
+        self.out = np.zeros((shape[0] * factor, shape[1] * factor), dtype)
+
+        # The output seen as a block for each pixel of the frame
+        self.blocks = self.out.reshape(shape[0], factor, shape[1], factor)
+
+    def __call__(self, frame):
+        self.blocks[:] = frame[:, None, :, None]
+
+        return self.out
+
+
+class Scale2xScaler(object):
+    factor = 2
+
+    def __init__(self, shape=(144, 160), dtype=np.uint8):
+        height, width = shape
+
+        self.out = np.zeros((height * 2, width * 2), dtype)
+        self.blocks = self.out.reshape(height, 2, width, 2)
+
+        # The frame with its edges repeated, so every pixel has four neighbours
+        self.padded = np.zeros((height + 2, width + 2), dtype)
+
+        self.above = self.padded[:-2, 1:-1]
+        self.below = self.padded[2:, 1:-1]
+        self.left = self.padded[1:-1, :-2]
+        self.right = self.padded[1:-1, 2:]
+
+        self.same = np.zeros(shape, np.bool_)
+
+    def __call__(self, frame):
+        padded = self.padded
+
+        padded[1:-1, 1:-1] = frame
+        padded[0, 1:-1] = frame[0]
+        padded[-1, 1:-1] = frame[-1]
+        padded[:, 0] = padded[:, 1]
+        padded[:, -1] = padded[:, -2]
+
+        above, below, left, right = self.above, self.below, self.left, self.right
+
+        # A corner takes the colour of its two neighbours when they match, unless that would make a block
+        for y, x, a, b, c, d in ((0, 0, left, above, below, right), (0, 1, above, right, left, below),
+                                 (1, 0, below, left, right, above), (1, 1, right, below, above, left)):
+            np.equal(a, b, out=self.same)
+            self.same &= a != c
+            self.same &= b != d
+
+            corner = self.blocks[:, y, :, x]
+            corner[:] = frame
+            np.copyto(corner, a, where=self.same)
+
+        return self.out
+
+
+class ChainScaler(object):
+    def __init__(self, scalers):
+        self.scalers = scalers
+        self.factor = int(np.prod([scaler.factor for scaler in scalers]))
+
+    def __call__(self, frame):
+        for scaler in self.scalers:
+            frame = scaler(frame)
+
+        return frame
+
+
+def get_scaler(name, shape=(144, 160), dtype=np.uint8):
+    if name in ("nearest2", "nearest3", "nearest4"):
+        return NearestScaler(int(name[-1]), shape, dtype)
+    elif name == "scale2x":
+        return Scale2xScaler(shape, dtype)
+    elif name == "scale4x":
+        return ChainScaler([Scale2xScaler(shape, dtype), Scale2xScaler((shape[0] * 2, shape[1] * 2), dtype)])
+
+    raise ValueError("Unknown scaler: " + str(name))
@@ -0,0 +1,110 @@
+from multiprocessing import resource_tracker, shared_memory
+import struct
+
+import numpy as np
+
+"""
+Shares the GPU's frames with other processes through shared memory. The GPU's ring of maps is placed in the
+shared memory, so publishing a frame only means writing the header, nothing is copied.
+
+Layout
+------------
+0x00 - Magic b"PGBF"
+0x04 - Version (uint32)
+0x08 - Number of slots (uint32)
+0x0C - Slot of the last published frame (uint32)
+0x10 - Published frames, the sequence number (uint64)
+0x18 - Frame number from the GPU (uint64)
+0x40 - The slots, each a (144, 160) uint8 map of shades
+"""
+
+MAGIC = b"PGBF"
+VERSION = 1
+
+HEADER = struct.Struct("<4sIIIQQ")
+HEADER_SIZE = 0x40
+FRAME_SIZE = 144 * 160
+
+
+# Attaches to shared memory made by another process without taking ownership of it
+def attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the memory to be unlinked when this process exits, even
+        # though it isn't the owner, so skip the registration
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def frame_views(buffer, slots):
+    return [np.ndarray((144, 160), np.uint8, buffer, HEADER_SIZE + slot * FRAME_SIZE) for slot in range(slots)]
+
+
+# Publishes the frames of a GPU into a new block of shared memory
+class SharedFrameWriter(object):
+    def __init__(self, gpu, name=None, slots=3):
+        self.gpu = gpu
+        self.slots = slots
+
+        self.memory = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + slots * FRAME_SIZE)
+        self.name = self.memory.name
+
+        # The header names the slot the GPU's last frame is moved into
+        gpu.set_frame_buffers(frame_views(self.memory.buf, slots))
+        self.write_header(gpu.front, 0, gpu.frame_number)
+
+        gpu.frame_listeners.append(self.publish)
+
+    def write_header(self, slot, sequence, frame_number):
+        HEADER.pack_into(self.memory.buf, 0, MAGIC, VERSION, self.slots, slot, sequence, frame_number)
+
+    def publish(self, gpu):
+        if not gpu.frame_unchanged:
+            self.write_header(gpu.front, gpu.published_frames, gpu.frame_number)
+
+    def close(self):
+        # Give the GPU its own maps back before the shared memory goes
+        self.gpu.frame_listeners.remove(self.publish)
+        self.gpu.set_frame_buffers([np.zeros((144, 160), np.uint8) for i in range(self.slots)])
+
+        self.memory.close()
+        self.memory.unlink()
+
+
+# Reads the frames published by a SharedFrameWriter in another process, without copying them
+class SharedFrameReader(object):
+    def __init__(self, name):
+        self.memory = attach(name)
+
+        magic, version, self.slots = HEADER.unpack_from(self.memory.buf, 0)[:3]
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a pythongb frame buffer: " + str(name))
+
+        self.frames = frame_views(self.memory.buf, self.slots)
+
+        for frame in self.frames:
+            frame.flags.writeable = False
+
+    def header(self):
+        return HEADER.unpack_from(self.memory.buf, 0)[3:]
+
+    # Returns the sequence number, the GPU's frame number and a read only view of the last published frame
+    def latest(self):
+        slot, sequence, frame_number = self.header()
+
+        return sequence, frame_number, self.frames[slot]
+
+    # A frame stays as it was until the GPU comes round the ring to draw into its slot again
+    def is_current(self, sequence):
+        return self.header()[1] - sequence < self.slots - 1
+
+    def close(self):
+        self.frames = None
+        self.memory.close()
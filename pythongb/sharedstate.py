@@ -0,0 +1,60 @@
+from multiprocessing import shared_memory
+
+from .arena import CPU_OFFSET, CPU_STATE, FLAGS, REGISTERS, STATE_SIZE, StateArena
+from .sharedframes import attach
+
+"""
+Shares the state of a GameBoy with other processes. The MemoryController's arena is moved into shared memory, so the
+memory regions seen by readers are always live. The registers and the rest of the state kept outside the arena are
+stored into it each time a frame is drawn.
+"""
+
+
+class SharedStateWriter(object):
+    def __init__(self, gameboy, name=None):
+        self.gameboy = gameboy
+
+        self.memory = shared_memory.SharedMemory(name=name, create=True, size=STATE_SIZE)
+        self.name = self.memory.name
+
+        gameboy.cpu.memory.set_state_buffer(self.memory.buf)
+        self.arena = gameboy.cpu.memory.arena
+
+        self.store(gameboy.gpu)
+        gameboy.gpu.frame_listeners.append(self.store)
+
+    def store(self, gpu):
+        self.arena.store(self.gameboy)
+
+    def close(self):
+        # Give the memory its own buffer back before the shared memory goes
+        self.gameboy.gpu.frame_listeners.remove(self.store)
+        self.gameboy.cpu.memory.set_state_buffer(None)
+        self.arena = None
+
+        self.memory.close()
+        self.memory.unlink()
+
+
+# Reads the state shared by a SharedStateWriter in another process
+class SharedStateReader(object):
+    def __init__(self, name):
+        self.memory = attach(name)
+        self.arena = StateArena(self.memory.buf)
+
+        # The memory regions by name, such as "wram"
+        self.regions = self.arena.regions
+
+    # The CPU registers, flags and clock as of the last frame drawn
+    def cpu_state(self):
+        values = CPU_STATE.unpack_from(self.arena.buffer, CPU_OFFSET)
+
+        return dict(zip(REGISTERS + FLAGS + ["halted", "clock", "last_clock_inc"], values))
+
+    def digest(self):
+        return self.arena.digest()
+
+    def close(self):
+        self.regions = None
+        self.arena = None
+        self.memory.close()
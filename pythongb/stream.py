@@ -0,0 +1,217 @@
+import os
+import socket
+import struct
+import threading
+
+import numpy as np
+
+from .scalers import get_scaler
+
+"""
+Streams the frames drawn by the GPU to viewers over a TCP or Unix socket. Frames are packed to 2 bits a pixel
+(40 bytes a line) and only the lines which changed since the last frame sent are sent. A viewer is sent every line
+when it connects. Encoding and sending are done on their own thread, if it falls behind frames are skipped.
+
+Message
+------------
+Length of the rest of the message (uint32), Frame number (uint64), Number of lines (uint8),
+then for each line: Line number (uint8), 40 bytes of pixels, 4 to a byte with the leftmost in the top bits
+"""
+
+MESSAGE = struct.Struct("<IQB")
+LINE_BYTES = 40
+
+
+def pack_lines(frame):
+    return (frame[:, 0::4] << 6) | (frame[:, 1::4] << 4) | (frame[:, 2::4] << 2) | frame[:, 3::4]
+
+
+def unpack_lines(packed, out):
+    out[:, 0::4] = packed >> 6
+    out[:, 1::4] = (packed >> 4) & 0b11
+    out[:, 2::4] = (packed >> 2) & 0b11
+    out[:, 3::4] = packed & 0b11
+
+
+def encode(frame_number, frame, lines):
+    packed = np.empty((len(lines), LINE_BYTES + 1), np.uint8)
+    packed[:, 0] = lines
+    packed[:, 1:] = pack_lines(frame[lines])
+
+    body = packed.tobytes()
+
+    return MESSAGE.pack(MESSAGE.size - 4 + len(body), frame_number, len(lines)) + body
+
+
+def make_socket(address):
+    # A string is the path of a Unix socket, otherwise a (host, port) pair
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+
+class FrameServer(object):
+    ALL_LINES = np.arange(144)
+
+    def __init__(self, gpu, address=("127.0.0.1", 0)):
+        self.gpu = gpu
+
+        self.server = make_socket(address)
+
+        if not isinstance(address, str):
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        self.server.bind(address)
+        self.server.listen(8)
+        self.address = self.server.getsockname()
+        self.path = address if isinstance(address, str) else None
+
+        self.running = True
+
+        # The newest frame not yet sent, and the last frame sent which the viewers all have
+        self.condition = threading.Condition()
+        self.pending = None
+        self.sent = gpu.latest_frame().copy()
+        self.sent_number = gpu.frame_number
+
+        self.clients = []
+        self.new_clients = []
+
+        self.acceptor = threading.Thread(target=self.accept_clients, name="pythongb-stream-accept")
+        self.acceptor.daemon = True
+        self.acceptor.start()
+
+        self.encoder = threading.Thread(target=self.send_frames, name="pythongb-stream")
+        self.encoder.daemon = True
+        self.encoder.start()
+
+        gpu.frame_listeners.append(self.on_frame)
+
+    def on_frame(self, gpu):
+        if gpu.frame_unchanged:
+            return
+
+        with self.condition:
+            # Replacing a frame which hasn't been sent yet skips it
+            self.pending = (gpu.frame_number, gpu.latest_frame().copy())
+            self.condition.notify()
+
+    def accept_clients(self):
+        while self.running:
+            try:
+                client, address = self.server.accept()
+            except OSError:
+                return
+
+            with self.condition:
+                self.new_clients.append(client)
+                self.condition.notify()
+
+    def send(self, clients, message):
+        for client in list(clients):
+            try:
+                client.sendall(message)
+            except OSError:
+                clients.remove(client)
+                client.close()
+
+    def send_frames(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending is None and not self.new_clients:
+                    self.condition.wait()
+
+                if not self.running:
+                    return
+
+                pending = self.pending
+                new_clients = self.new_clients
+
+                self.pending = None
+                self.new_clients = []
+
+            # New viewers are sent the whole of the last frame, then get the changes from it like the others
+            if new_clients:
+                self.send(new_clients, encode(self.sent_number, self.sent, FrameServer.ALL_LINES))
+                self.clients.extend(new_clients)
+
+            if pending is not None:
+                frame_number, frame = pending
+                lines = np.flatnonzero((frame != self.sent).any(axis=1))
+
+                self.send(self.clients, encode(frame_number, frame, lines))
+
+                self.sent = frame
+                self.sent_number = frame_number
+
+    def close(self):
+        if self.on_frame in self.gpu.frame_listeners:
+            self.gpu.frame_listeners.remove(self.on_frame)
+
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        self.encoder.join()
+
+        # Shutting down wakes the accept thread
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        self.server.close()
+        self.acceptor.join()
+
+        if self.path is not None:
+            os.unlink(self.path)
+
+        for client in self.clients + self.new_clients:
+            client.close()
+
+
+# A simple viewer, which keeps the last frame received. The frame can be scaled by one of the scalers in scalers.py
+class FrameClient(object):
+    def __init__(self, address, timeout=None, scale=None):
+        self.socket = make_socket(address)
+        self.socket.settimeout(timeout)
+        self.socket.connect(address)
+
+        self.frame = np.zeros((144, 160), np.uint8)
+        self.frame_number = 0
+
+        self.scaler = get_scaler(scale) if scale is not None else None
+
+    def read(self, size):
+        data = bytearray()
+
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+
+            if not chunk:
+                raise EOFError("The frame server closed the connection")
+
+            data += chunk
+
+        return data
+
+    # Waits for the next message and applies it, returning the frame number and the frame
+    def receive(self):
+        length, frame_number, count = MESSAGE.unpack(self.read(MESSAGE.size))
+
+        packed = np.frombuffer(self.read(length - MESSAGE.size + 4), np.uint8).reshape(count, LINE_BYTES + 1)
+
+        lines = np.empty((count, 160), np.uint8)
+        unpack_lines(packed[:, 1:], lines)
+
+        self.frame[packed[:, 0]] = lines
+        self.frame_number = frame_number
+
+        if self.scaler is not None:
+            return frame_number, self.scaler(self.frame)
+
+        return frame_number, self.frame
+
+    def close(self):
+        self.socket.close()
@@ -0,0 +1,178 @@
+from multiprocessing import shared_memory
+import multiprocessing
+
+import numpy as np
+
+from .env import GameBoyEnv, observation_shape
+from .sharedframes import attach
+
+"""
+Runs a batch of GameBoyEnvs split across worker processes. The actions, observations and info of every environment
+are arrays in one block of shared memory: the workers step their environments straight into the observation batch,
+so nothing is pickled or copied between processes. Each step the main process writes the actions and the command,
+wakes the workers with a semaphore each and waits for them all on a shared one.
+
+Layout
+------------
+0x00 - Command (int32)
+0x40 - Actions (int32), then the frame numbers and CPU clocks (uint64), one for each environment, then the
+       (count, height, width) uint8 observations
+"""
+
+STEP = 1
+RESET = 2
+CLOSE = 3
+
+HEADER_SIZE = 0x40
+
+
+def layout(count, shape):
+    actions = HEADER_SIZE
+    frames = actions + -(-count * 4 // 8) * 8
+    clocks = frames + count * 8
+    observations = clocks + count * 8
+
+    return actions, frames, clocks, observations, observations + count * shape[0] * shape[1]
+
+
+# The arrays in the shared memory, as (command, actions, frames, clocks, observations)
+def shared_arrays(buffer, count, shape):
+    actions, frames, clocks, observations, size = layout(count, shape)
+
+    return (np.ndarray(1, np.int32, buffer, 0), np.ndarray(count, np.int32, buffer, actions),
+            np.ndarray(count, np.uint64, buffer, frames), np.ndarray(count, np.uint64, buffer, clocks),
+            np.ndarray((count,) + shape, np.uint8, buffer, observations))
+
+
+def run_worker(name, count, shape, indices, rom_path, options, setup, start, done):
+    memory = attach(name)
+    command, actions, frames, clocks, observations = shared_arrays(memory.buf, count, shape)
+
+    envs = []
+
+    for i in indices:
+        env = GameBoyEnv(rom_path, **options)
+
+        if setup is not None:
+            setup(env)
+            env.set_start()
+
+        envs.append(env)
+
+    done.release()
+
+    while True:
+        start.acquire()
+
+        if command[0] == CLOSE:
+            break
+
+        for i, env in zip(indices, envs):
+            if command[0] == STEP:
+                env.step(actions[i], observations[i])
+            else:
+                env.reset(observations[i])
+
+            frames[i] = env.gameboy.gpu.frame_number
+            clocks[i] = env.gameboy.cpu.clock
+
+        done.release()
+
+    del command, actions, frames, clocks, observations
+    memory.close()
+
+
+class VectorEnv(object):
+    # Runs count environments of the ROM across processes workers, the options are those of GameBoyEnv. setup is
+    # called with each environment once it is made, before its start is set, and has to be picklable
+    def __init__(self, rom_path, count, processes=None, setup=None, **options):
+        processes = min(processes or multiprocessing.cpu_count(), count)
+
+        self.count = count
+        self.observation_shape = observation_shape(options.get("downsample", 1))
+
+        self.memory = shared_memory.SharedMemory(create=True, size=layout(count, self.observation_shape)[-1])
+        self.command, self.actions, self.frames, self.clocks, self.observations = \
+            shared_arrays(self.memory.buf, count, self.observation_shape)
+
+        self.done = multiprocessing.Semaphore(0)
+        self.starts = []
+        self.workers = []
+        self.closed = False
+
+        try:
+            for worker in range(processes):
+                start = multiprocessing.Semaphore(0)
+                indices = list(range(worker, count, processes))
+
+                process = multiprocessing.Process(target=run_worker, name="pythongb-env-%d" % worker,
+                                                  args=(self.memory.name, count, self.observation_shape, indices,
+                                                        rom_path, options, setup, start, self.done))
+                process.daemon = True
+                process.start()
+
+                self.starts.append(start)
+                self.workers.append(process)
+
+            # Wait for the environments to be made
+            self.wait()
+        except BaseException:
+            # A worker failed to start, so stop the others rather than leave them waiting, and free the memory
+            for process in self.workers:
+                process.terminate()
+                process.join()
+
+            self.release()
+            raise
+
+    def wait(self):
+        for i in range(len(self.workers)):
+            while not self.done.acquire(timeout=0.5):
+                if not all(process.is_alive() for process in self.workers):
+                    raise RuntimeError("A pythongb environment worker has stopped")
+
+    def run(self, command):
+        self.command[0] = command
+
+        for start in self.starts:
+            start.release()
+
+        self.wait()
+
+    def info(self):
+        return {"frame": self.frames, "clock": self.clocks}
+
+    # Resets every environment. The observations returned are the shared batch, which the next step overwrites
+    def reset(self):
+        self.run(RESET)
+
+        return self.observations, self.info()
+
+    # Steps every environment with its action from actions, returning the batch of observations and the info
+    def step(self, actions):
+        self.actions[:] = actions
+        self.run(STEP)
+
+        return self.observations, self.info()
+
+    # Frees the shared memory, the arrays over it have to go first
+    def release(self):
+        self.closed = True
+        self.command = self.actions = self.frames = self.clocks = self.observations = None
+
+        self.memory.close()
+        self.memory.unlink()
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.command[0] = CLOSE
+
+        for start in self.starts:
+            start.release()
+
+        for process in self.workers:
+            process.join()
+
+        self.release()
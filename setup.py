@@ -8,7 +8,11 @@ config = {
     'author': 'Thomas Allsop',
     'url': 'https://github.com/tallsop/pythongb',
     'version': '0.1',
-    'install_requires': ['nose', 'PyOpenGL', 'Pillow', 'vispy'],
+    'install_requires': ['nose', 'numpy'],
+    'extras_require': {
+        'display': ['PyOpenGL', 'vispy'],
+        'pil': ['Pillow']
+    },
     'packages': ['pythongb'],
     'scripts': [],
     'name': 'pythongb'
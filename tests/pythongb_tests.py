@@ -1,6 +1,10 @@
 from nose.tools import *
 from pythongb.cpu import *
 from pythongb.gb import *
+from pythongb.gpu import GPU
+from pythongb.memory import MemoryController
+
+import numpy as np
 
 # The testing of the correctness of opcodes will be done using a test rom
 def test_cpu():
@@ -89,3 +93,1160 @@ def test_cpu():
 
 
 
+
+
+def make_gameboy_memory():
+    cpu = CPU(False)
+    memory = cpu.memory
+    gpu = GPU(memory)
+
+    memory.attach_gpu(gpu)
+    gpu.attach_cpu(cpu)
+
+    return memory, gpu
+
+
+# Tile 1 is solid colour 3, shown with the identity palette and the background on unless lcdc says otherwise
+def fill_tile(memory, lcdc=0b10010001):
+    for i in range(16):
+        memory.write(0x8010 + i, 0xFF)
+
+    memory.write(0xFF47, 0b11100100)
+    memory.write(0xFF40, lcdc)
+
+
+def test_sprites():
+    memory, gpu = make_gameboy_memory()
+
+    # Tile 1 is solid colour 3, tile 2 is colour 1 on its leftmost column only
+    for i in range(8):
+        memory.write(0x8010 + i * 2, 0xFF)
+        memory.write(0x8011 + i * 2, 0xFF)
+        memory.write(0x8020 + i * 2, 0x80)
+
+    # Identity palettes, background and sprites on
+    memory.write(0xFF47, 0b11100100)
+    memory.write(0xFF48, 0b11100100)
+    memory.write(0xFF49, 0b00011011)
+    memory.write(0xFF40, 0b10010011)
+
+    # A sprite at the top left, one flipped in x using OBP1 and one behind the background
+    for i, sprite in enumerate([(16, 8, 1, 0x00), (16, 20, 2, 0x30), (24, 40, 1, 0x80)]):
+        for j, value in enumerate(sprite):
+            memory.write(0xFE00 + i * 4 + j, value)
+
+    gpu.line = 0
+    gpu.draw_line()
+
+    shades = gpu.map[0]
+
+    assert (shades[0:8] == 3).all()
+    assert shades[8] == 0
+    assert shades[19] == 2
+    assert shades[12] == 0
+
+    # The background is colour 0 so the sprite with priority still shows
+    gpu.line = 8
+    gpu.draw_line()
+    assert gpu.map[8, 32] == 3
+
+    # Only 10 sprites may be drawn on a line
+    for i in range(40):
+        for j, value in enumerate((60, 8 + i * 4, 1, 0)):
+            memory.write(0xFE00 + i * 4 + j, value)
+
+    gpu.line = 44
+    gpu.draw_line()
+    assert (gpu.map[44, :44] == 3).all()
+    assert (gpu.map[44, 44:] == 0).all()
+
+
+def test_window():
+    memory, gpu = make_gameboy_memory()
+
+    # Tile 1 fills the window's map at 0x9C00
+    for i in range(0x400):
+        memory.write(0x9C00 + i, 1)
+
+    memory.write(0xFF4A, 10)
+    memory.write(0xFF4B, 7 + 100)
+    fill_tile(memory, 0b11110001)
+
+    for line in range(144):
+        gpu.line = line
+        gpu.draw_line()
+
+    assert (gpu.map[:10] == 0).all()
+    assert (gpu.map[10:, :100] == 0).all()
+    assert (gpu.map[10:, 100:] == 3).all()
+    assert gpu.window_line == 134
+
+
+def test_gpu_timing():
+    memory, gpu = make_gameboy_memory()
+    cpu = gpu.cpu
+
+    # Nothing happens while the LCD is off
+    cpu.clock = 5000
+    assert gpu.next_event == GPU.NEVER
+    assert memory.read(0xFF44) == 0
+
+    memory.write(0xFF47, 0b11100100)
+    memory.write(0xFF40, 0b10010001)
+
+    # Part way through line 3, in the H-Blank
+    cpu.clock = 5000 + 3 * 456 + 300
+    assert memory.read(0xFF44) == 3
+    assert memory.read(0xFF41) & 0b11 == 0
+
+    cpu.clock = 5000 + 3 * 456 + 100
+    assert memory.read(0xFF41) & 0b11 == 3
+
+    # The line compare interrupt is scheduled for line 10
+    memory.write(0xFF45, 10)
+    memory.write(0xFF41, 0b01000000)
+    assert gpu.next_event == 5000 + 10 * 456
+
+    cpu.clock = gpu.next_event
+    gpu.update()
+    assert memory.io[0x0F] & 0x02
+    assert memory.read(0xFF41) & 0b100
+    assert gpu.next_event == 5000 + 144 * 456
+
+    # Changing the scroll draws the earlier lines first
+    memory.write(0xFF42, 8)
+    assert gpu.line == 10
+
+    cpu.clock = gpu.next_event
+    gpu.update()
+    assert memory.io[0x0F] & 0x01
+    assert gpu.line == 144
+    assert gpu.get_frame() is not None
+    assert memory.read(0xFF41) & 0b11 == 1
+
+    cpu.clock = 5000 + 154 * 456
+    gpu.update()
+    assert memory.read(0xFF44) == 0
+    assert gpu.line == 0
+
+    # Turning the LCD off stops the GPU
+    memory.write(0xFF40, 0)
+    assert gpu.next_event == GPU.NEVER
+
+
+def test_unchanged_frames():
+    memory, gpu = make_gameboy_memory()
+    cpu = gpu.cpu
+
+    memory.write(0x9800, 1)
+    fill_tile(memory)
+
+    def run_frame():
+        cpu.clock += GPU.FRAME_CLOCKS
+        gpu.update()
+
+    run_frame()
+    assert not gpu.frame_unchanged
+    assert gpu.changed_lines.all()
+
+    run_frame()
+    assert gpu.frame_unchanged
+    assert not gpu.changed_lines.any()
+
+    # Scrolling half way down the frame only draws the lines after it again
+    cpu.clock += 100 * 456
+    memory.write(0xFF43, 4)
+    cpu.clock += 54 * 456
+    gpu.update()
+    assert not gpu.frame_unchanged
+    assert not gpu.changed_lines[:100].any()
+    assert gpu.changed_lines[100:].all()
+
+    run_frame()
+    assert gpu.changed_lines[:100].all()
+    assert not gpu.changed_lines[100:].any()
+
+    # Writing the same value again does not count as a change
+    memory.write(0x9800, 1)
+    memory.write(0xFF43, 4)
+    run_frame()
+    assert gpu.frame_unchanged
+
+
+def test_frame_ring():
+    memory, gpu = make_gameboy_memory()
+    cpu = gpu.cpu
+
+    fill_tile(memory)
+
+    cpu.clock += GPU.FRAME_CLOCKS
+    gpu.update()
+
+    first = gpu.get_frame()
+    assert not first.flags.writeable
+    assert gpu.get_frame() is None
+
+    # Drawing the next frame does not touch the one handed out
+    memory.write(0x9800, 1)
+    cpu.clock += GPU.FRAME_CLOCKS
+    gpu.update()
+
+    second = gpu.get_frame()
+    assert (first[:8, :8] == 0).all()
+    assert (second[:8, :8] == 3).all()
+
+    # An unchanged frame is not copied into the next map, but the lines are when the map is next used
+    cpu.clock += GPU.FRAME_CLOCKS
+    gpu.update()
+    assert gpu.frame_unchanged
+    assert gpu.get_frame() is second
+
+    memory.write(0x9801, 1)
+    cpu.clock += GPU.FRAME_CLOCKS
+    gpu.update()
+    third = gpu.get_frame()
+
+    assert (third[:8, :16] == 3).all()
+    assert gpu.frame_number == 4
+    assert gpu.published_frames == 3
+
+
+def test_emulation_thread():
+    import tempfile
+    import threading
+    from pythongb.renderers import ArrayRenderer
+
+    gb = make_rom(COUNTING_PROGRAM, tempfile.mktemp())
+    show_stripes(gb.cpu.memory)
+    gb.set_turbo(True)
+
+    renderer = ArrayRenderer(gb.gpu)
+
+    # Set once the GPU has handed a few frames to the thread drawing them
+    published = threading.Event()
+    gb.frame_hooks.append(lambda gameboy: gameboy.gpu.published_frames >= 3 and published.set())
+
+    worker = threading.Thread(target=gb.emulate, args=(renderer,), name="pythongb-emulation")
+    worker.daemon = True
+    worker.start()
+
+    assert published.wait(5)
+    assert renderer.image.any()
+
+    # Stopping finishes the frame being run and the thread exits
+    gb.stop()
+    worker.join(5)
+    assert not worker.is_alive()
+
+
+def test_headless_import():
+    import os
+    import subprocess
+    import sys
+
+    # Importing and running the core loads none of the display or image libraries
+    script = ("import sys\n"
+              "import pythongb\n"
+              "from pythongb.gb import GameBoy\n"
+              "GameBoy().run_frame()\n"
+              "print(' '.join(name for name in ('vispy', 'OpenGL', 'PIL') if name in sys.modules))\n")
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    loaded = subprocess.check_output([sys.executable, "-c", script], cwd=root).split()
+
+    assert loaded == []
+
+
+def test_frame_skip():
+    memory, gpu = make_gameboy_memory()
+    cpu = gpu.cpu
+
+    memory.write(0xFF47, 0b11100100)
+    memory.write(0xFF40, 0b10010001)
+    gpu.set_frame_skip(3)
+
+    drawn = []
+
+    for i in range(6):
+        # A different scroll each frame, so every drawn frame is a new one
+        memory.write(0xFF42, i)
+        memory.write(0x9800 + i * 32, 1)
+
+        cpu.clock += 100 * 456
+        assert memory.read(0xFF44) == 100
+
+        cpu.clock += 54 * 456
+        gpu.update()
+
+        drawn.append(gpu.get_frame() is not None)
+
+    assert drawn == [True, False, False, True, False, False]
+    assert gpu.frame_number == 6
+    assert gpu.published_frames == 2
+
+
+def test_pacer():
+    from pythongb.pacer import FramePacer
+
+    # Time only moves when the pacer sleeps or the test moves it on, so a busy host can't change the result
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    pacer = FramePacer(frame_rate=100.0, max_skip=3, clock=lambda: now[0], sleep=sleep)
+
+    # On time frames are slept for, not skipped
+    for i in range(10):
+        assert pacer.wait() == 0
+
+    assert abs(now[0] - 0.1) < 1e-9
+
+    # Falling behind skips the frames which were missed, up to the limit
+    sleep(0.035)
+    assert pacer.wait() == 2
+
+    sleep(0.2)
+    assert pacer.wait() == 3
+    assert pacer.wait() == 0
+
+
+def make_rom(program, path, cart_type=0x00):
+    # A ROM only cartridge, unless another type is given, with the program at 0x100 where the bios hands over to it
+    rom = bytearray(0x8000)
+    rom[0x100:0x100 + len(program)] = program
+    rom[0x147] = cart_type
+
+    with open(path, "wb") as stream:
+        stream.write(rom)
+
+    gb = GameBoy()
+    gb.load_rom(path)
+
+    gb.cpu.memory.bios_use = False
+    gb.cpu.r["pc"] = 0x100
+
+    return gb
+
+
+# INC A, LDH (0x43), A, JR back: the background scrolls as it runs
+COUNTING_PROGRAM = [0x3C, 0xE0, 0x43, 0x18, 0xFB]
+
+# LDH A, (0x00), LDH (0x80), A, LDH (0x43), A, JR back: the directions held scroll the background
+SCROLLING_PROGRAM = [0xF0, 0x00, 0xE0, 0x80, 0xE0, 0x43, 0x18, 0xF8]
+
+
+# Tile 0 has a stripe of colour 3, so the scroll shows in the frames
+def show_stripes(memory):
+    memory.write(0x8000, 0x0F)
+    memory.write(0xFF47, 0xE4)
+    memory.write(0xFF40, 0x91)
+
+
+# Runs the ROM loaded from 0x100 with the stripes shown and the directions selected at 0xFF00, for SCROLLING_PROGRAM
+def setup_scrolling(gameboy):
+    memory = gameboy.cpu.memory
+
+    memory.bios_use = False
+    gameboy.cpu.r["pc"] = 0x100
+
+    memory.write(0xFF00, 0x20)
+    show_stripes(memory)
+
+
+def make_scrolling_rom(path):
+    gb = make_rom(SCROLLING_PROGRAM, path)
+    setup_scrolling(gb)
+
+    return gb
+
+
+# The CPU, memory controller and memory of a GameBoy, which match when two have run the same. The GPU block and
+# frames are left out as they depend on what has been drawn, and the joypad block on how input was fed in
+def machine_state(gameboy):
+    from pythongb.arena import CPU_OFFSET, FRAMES_OFFSET, GPU_OFFSET, REGIONS_OFFSET
+
+    arena = gameboy.cpu.memory.arena
+    arena.store(gameboy)
+
+    return bytes(arena.buffer[CPU_OFFSET:GPU_OFFSET]) + bytes(arena.buffer[REGIONS_OFFSET:FRAMES_OFFSET])
+
+
+def test_halt_and_pause():
+    import os
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        check_halt_and_pause(os.path.join(directory, "halt.gb"))
+    finally:
+        shutil.rmtree(directory)
+
+
+def check_halt_and_pause(path):
+    import threading
+
+    # HALT straight away
+    gb = make_rom([0x76], path)
+
+    gb.step()
+    assert gb.cpu.halted
+
+    # While halted the clock jumps on a line at a time with the LCD off, and to the V-Blank with it on
+    gb.run_frame()
+    assert gb.cpu.halted
+
+    gb.cpu.memory.write(0xFF40, 0x80)
+    steps = 0
+
+    while gb.gpu.frame_number == 0:
+        gb.step()
+        steps += 1
+
+    assert steps == 1
+    assert gb.cpu.clock == gb.gpu.frame_start + GPU.VBLANK_CLOCKS
+
+    # The V-Blank interrupt wakes it once it is enabled
+    assert gb.cpu.halted
+    gb.cpu.memory.write(0xFFFF, 0x01)
+    gb.step()
+    assert not gb.cpu.halted
+
+    # A paused emulation thread waits without running
+    gb = make_rom([0x76], path)
+    gb.set_turbo(True)
+
+    frames = threading.Event()
+    gb.frame_hooks.append(lambda gameboy: frames.set())
+
+    worker = threading.Thread(target=gb.emulate)
+    worker.start()
+
+    assert gb.pause().wait(5)
+    assert gb.paused()
+
+    clock = gb.cpu.clock
+    frames.clear()
+
+    # Resumed it runs frames again
+    gb.resume()
+    assert not gb.waiting.is_set()
+    assert frames.wait(5)
+    assert gb.cpu.clock > clock
+
+    gb.stop()
+    worker.join(5)
+    assert not worker.is_alive()
+
+
+def test_shared_frames():
+    from pythongb.sharedframes import SharedFrameReader, SharedFrameWriter
+
+    memory, gpu = make_gameboy_memory()
+    cpu = gpu.cpu
+
+    fill_tile(memory)
+
+    writer = SharedFrameWriter(gpu)
+    reader = SharedFrameReader(writer.name)
+
+    assert reader.latest()[0] == 0
+
+    cpu.clock += GPU.FRAME_CLOCKS
+    gpu.update()
+
+    sequence, frame_number, frame = reader.latest()
+    assert (sequence, frame_number) == (1, 1)
+    assert not frame.flags.writeable
+
+    # The GPU draws straight into the shared memory
+    assert np.shares_memory(gpu.latest_frame(), gpu.frames[gpu.front])
+    assert (frame == gpu.latest_frame()).all()
+
+    memory.write(0x9800, 1)
+    cpu.clock += GPU.FRAME_CLOCKS
+    gpu.update()
+
+    assert reader.is_current(sequence)
+    assert reader.latest()[2][0, 0] == 3
+
+    memory.write(0x9801, 1)
+    cpu.clock += GPU.FRAME_CLOCKS
+    gpu.update()
+    assert not reader.is_current(sequence)
+
+    del frame
+    reader.close()
+    writer.close()
+
+    # The GPU carries on with its own maps
+    assert gpu.latest_frame()[0, 8] == 3
+
+    # With any number of slots the reader starts on the frame the GPU already had
+    for slots in (2, 5):
+        writer = SharedFrameWriter(gpu, slots=slots)
+        reader = SharedFrameReader(writer.name)
+
+        frame = reader.latest()[2]
+        assert frame[0, 8] == 3
+        assert (frame == gpu.latest_frame()).all()
+
+        del frame
+        reader.close()
+        writer.close()
+
+
+def test_recorder():
+    import os
+    import tempfile
+    from PIL import Image
+    from pythongb.recorder import FrameRecorder, read_raw
+
+    memory, gpu = make_gameboy_memory()
+    cpu = gpu.cpu
+
+    fill_tile(memory)
+
+    directory = tempfile.mkdtemp()
+    raw = FrameRecorder(gpu, os.path.join(directory, "frames.raw"))
+    gif = FrameRecorder(gpu, os.path.join(directory, "frames.gif"), "gif", policy="drop")
+
+    # Frames 1 and 2 are the same, as are 4 and 5
+    for i in range(5):
+        if i in (2, 3):
+            memory.write(0x9800 + i, 1)
+
+        cpu.clock += GPU.FRAME_CLOCKS
+        gpu.update()
+
+    raw.close()
+    gif.close()
+
+    frames = list(read_raw(os.path.join(directory, "frames.raw")))
+    assert [frame_number for frame_number, frame in frames] == [1, 3, 4]
+    assert frames[2][1][0, 16] == 3
+    assert raw.duplicates == 2
+
+    image = Image.open(os.path.join(directory, "frames.gif"))
+    assert image.n_frames == 3
+    assert image.size == (160, 144)
+
+    # A writer which fails raises its error on the emulation thread rather than leaving it blocked on the queue
+    png = FrameRecorder(gpu, os.path.join(directory, "frames.raw", "frames"), "png", queue_size=1)
+    gif = FrameRecorder(gpu, os.path.join(directory, "limited.gif"), "gif", max_gif_frames=1)
+
+    def next_frame(i):
+        memory.write(0x9810 + i, 1)
+        cpu.clock += GPU.FRAME_CLOCKS
+        gpu.update()
+
+    # The directory can't be made under a file, so the writer stops straight away
+    png.writer.join(5)
+    assert_raises(OSError, next_frame, 0)
+    assert_raises(OSError, png.close)
+
+    # GIFs are kept in memory, so only so many frames can be recorded
+    next_frame(1)
+    assert gif.recorded == 1
+    assert_raises(ValueError, next_frame, 2)
+    gif.close()
+
+
+def test_frame_stream():
+    import os
+    import tempfile
+    from pythongb.stream import FrameClient, FrameServer, encode
+
+    memory, gpu = make_gameboy_memory()
+    cpu = gpu.cpu
+
+    fill_tile(memory)
+
+    for address in [("127.0.0.1", 0), os.path.join(tempfile.mkdtemp(), "frames.sock")]:
+        server = FrameServer(gpu, address)
+        client = FrameClient(server.address, timeout=5)
+
+        # Every line is sent on connecting
+        frame_number, frame = client.receive()
+        assert (frame == gpu.latest_frame()).all()
+
+        memory.write(0x9800 + (frame_number % 32), 1)
+        cpu.clock += GPU.FRAME_CLOCKS
+        gpu.update()
+
+        frame_number, frame = client.receive()
+        assert frame_number == gpu.frame_number
+        assert (frame == gpu.latest_frame()).all()
+
+        client.close()
+        server.close()
+
+    # A changed line is 41 bytes on the wire, rather than 1920 as float RGB
+    frame = np.zeros((144, 160), np.uint8)
+    assert len(encode(1, frame, np.arange(1))) == 13 + 41
+
+
+def test_scalers():
+    from pythongb.scalers import get_scaler
+
+    frame = np.zeros((144, 160), np.uint8)
+    frame[10:20, 10:20] = 3
+    frame[50, 50] = 1
+
+    nearest = get_scaler("nearest3")
+    out = nearest(frame)
+    assert out.shape == (432, 480)
+    assert (out == np.repeat(np.repeat(frame, 3, 0), 3, 1)).all()
+
+    # The output is made once and reused
+    assert nearest(frame) is out
+
+    # The inside corner of a diagonal edge is filled in, the pixels themselves keep their shape
+    frame[:] = 0
+    frame[1, 1] = frame[2, 2] = frame[1, 2] = 2
+    out = get_scaler("scale2x")(frame)
+
+    assert (out[2:4, 2:4] == 2).all()
+    assert (out[4:6, 4:6] == 2).all()
+    assert (out[4:6, 2:4] == [[0, 2], [0, 0]]).all()
+
+    frame[:] = 0
+    frame[10:20, 10:20] = 3
+    out = get_scaler("scale4x")(frame)
+    nearest = np.repeat(np.repeat(frame, 4, 0), 4, 1)
+    assert out.shape == (576, 640)
+
+    # Only the corners of the square are rounded off
+    assert out[40, 40] == 0
+    assert (out[44:76, 44:76] == 3).all()
+    assert (out[out != nearest] == 0).all()
+
+
+def test_save_state():
+    import tempfile
+
+    gb = make_rom(COUNTING_PROGRAM, tempfile.mktemp())
+    show_stripes(gb.cpu.memory)
+
+    gb.run_frame()
+    state = gb.save_state()
+
+    frames = [gb.run_frame().copy() for i in range(3)]
+    clock = gb.cpu.clock
+
+    # Loading goes back to where it was saved, and it runs the same from there
+    gb.load_state(state)
+    assert gb.save_state() == state
+
+    assert all((gb.run_frame() == frame).all() for frame in frames)
+    assert gb.cpu.clock == clock
+    assert len(np.unique(frames[0])) > 1
+
+    path = tempfile.mktemp()
+    gb.save_state(path)
+    gb.run_frame()
+
+    gb.load_state(path)
+    assert gb.cpu.clock == clock
+
+    assert_raises(ValueError, gb.load_state, bytes(len(state)))
+
+
+def test_save_state_wrapped_registers():
+    import tempfile
+
+    # DEC BC, DEC DE, LD A, (HL-), CALL with SP at 0: every pair and SP wraps below 0
+    gb = make_rom([0x0B, 0x1B, 0x3A, 0xCD, 0x00, 0x01], tempfile.mktemp())
+
+    for i in range(4):
+        gb.step()
+
+    assert [gb.cpu.getAB(a, b) for a, b in ("bc", "de", "hl")] == [0xFFFF] * 3
+    assert gb.cpu.r["sp"] == 0xFFFE
+
+    state = gb.save_state()
+    gb.step()
+
+    gb.load_state(state)
+    assert gb.save_state() == state
+    assert gb.cpu.r["b"] == 0xFF and gb.cpu.r["sp"] == 0xFFFE
+
+
+def test_state_arena():
+    import tempfile
+    from pythongb.sharedstate import SharedStateReader
+
+    gb = make_rom([0x3C, 0xE0, 0x43, 0x18, 0xFB], tempfile.mktemp())
+    memory = gb.cpu.memory
+    arena = memory.arena
+
+    memory.write(0xC010, 0x42)
+    memory.write(0xFF40, 0x91)
+    gb.run_frame()
+
+    # The memory is the arena, so only the registers need storing before a snapshot
+    assert arena.regions["wram"][0x10] == 0x42
+
+    arena.store(gb)
+    snapshot = arena.snapshot()
+    digest = arena.digest()
+
+    gb.run_frame()
+    memory.write(0xC010, 0x43)
+    arena.store(gb)
+    assert arena.digest() != digest
+
+    arena.load(snapshot)
+    arena.restore(gb)
+    assert memory.read(0xC010) == 0x42
+    assert arena.digest() == digest
+
+    # Other processes can map the live state
+    writer = gb.share_state()
+    reader = SharedStateReader(writer.name)
+
+    memory.write(0xC010, 0x44)
+    assert reader.regions["wram"][0x10] == 0x44
+
+    gb.run_frame()
+    assert reader.cpu_state()["clock"] == gb.cpu.clock
+    assert reader.digest() == memory.arena.digest()
+
+    reader.close()
+    writer.close()
+
+    # The GPU's views follow the memory back out of the shared memory
+    assert memory.read(0xC010) == 0x44
+
+    memory.write(0x8000, 0xFF)
+    assert gb.gpu.vram[0] == 0xFF
+
+
+def test_rewind():
+    import tempfile
+
+    gb = make_rom(COUNTING_PROGRAM, tempfile.mktemp())
+    show_stripes(gb.cpu.memory)
+
+    rewinder = gb.enable_rewind(interval=2, keyframe_interval=3, max_bytes=1 << 30)
+
+    clocks = [gb.cpu.clock]
+    frames = [gb.gpu.latest_frame().copy()]
+
+    for i in range(12):
+        frames.append(gb.run_frame().copy())
+        clocks.append(gb.cpu.clock)
+
+    assert rewinder.frames() == [2, 4, 6, 8, 10, 12]
+
+    # Back to a snapshot, then between snapshots where it has to emulate forward
+    assert gb.rewind(4) == 4
+    assert gb.cpu.clock == clocks[8]
+
+    assert gb.rewind(3) == 3
+    assert gb.cpu.clock == clocks[5]
+    assert (gb.gpu.latest_frame() == frames[5]).all()
+
+    # The snapshots after it are gone, and new ones are taken from here
+    assert rewinder.frames() == [2, 4]
+
+    for i in range(5):
+        assert (gb.run_frame() == frames[6 + i]).all()
+
+    assert rewinder.frames() == [2, 4, 6, 8, 10]
+
+    # Only what fits is kept, a whole keyframe and its deltas at a time
+    rewinder.max_bytes = rewinder.size
+    gb.run_frame()
+    gb.run_frame()
+
+    frames = rewinder.frames()
+    assert rewinder.size <= rewinder.max_bytes
+    assert frames[0] > 2 and frames[-1] == 12
+    assert rewinder.snapshots[0][1]
+
+    assert gb.rewind(100) == 12 - frames[0]
+
+    rewinder.close()
+
+
+def test_rewind_small_budget():
+    import tempfile
+
+    gb = make_rom(COUNTING_PROGRAM, tempfile.mktemp())
+    show_stripes(gb.cpu.memory)
+
+    # Less than a keyframe and its deltas fit, so the newest snapshots have to start runs of their own
+    rewinder = gb.enable_rewind(interval=1, keyframe_interval=30, max_bytes=1500)
+
+    clocks = [gb.cpu.clock]
+
+    for i in range(8):
+        gb.run_frame()
+        clocks.append(gb.cpu.clock)
+
+    frames = rewinder.frames()
+    assert frames[-1] == 8
+    assert rewinder.snapshots[0][1]
+
+    assert gb.rewind(1) == 1
+    assert gb.cpu.clock == clocks[7]
+
+    rewinder.close()
+
+
+def test_fork():
+    import tempfile
+
+    gb = make_rom(COUNTING_PROGRAM, tempfile.mktemp())
+    show_stripes(gb.cpu.memory)
+    gb.run_frame()
+
+    # Only the ROM is shared, the child has its own copy of the state
+    child = gb.fork()
+    assert child.cpu.memory.rom is gb.cpu.memory.rom
+    assert child.cpu.memory.arena.buffer.obj is not gb.cpu.memory.arena.buffer.obj
+    assert child.cpu.clock == gb.cpu.clock
+    assert machine_state(child) == machine_state(gb)
+
+    # Stepping the child moves it on without the parent
+    state = machine_state(gb)
+    child.step()
+    assert child.cpu.clock > gb.cpu.clock
+    assert machine_state(gb) == state
+    gb.step()
+
+    # The child runs the same, but changing it leaves the parent alone
+    assert (child.run_frame() == gb.run_frame()).all()
+
+    child.cpu.memory.write(0xC000, 0x12)
+    child.cpu.r["a"] = (child.cpu.r["a"] + 3) & 0xFF
+
+    assert gb.cpu.memory.read(0xC000) == 0
+    assert not (child.run_frame() == gb.run_frame()).all()
+
+
+def test_run_ahead():
+    import tempfile
+
+    gb = make_rom(COUNTING_PROGRAM, tempfile.mktemp())
+    show_stripes(gb.cpu.memory)
+    gb.run_frame()
+
+    plain = gb.fork()
+    hooks = []
+    gb.frame_hooks.append(hooks.append)
+
+    for i in range(3):
+        frame = gb.run_frame_ahead(2).copy()
+
+        # The frame shown is 2 frames ahead, but the emulation has only moved on by one
+        plain.run_frame()
+        assert gb.cpu.clock == plain.cpu.clock
+
+        ahead = plain.fork()
+        ahead.run_frame()
+        assert (frame == ahead.run_frame()).all()
+
+    # Frames run ahead are not seen by the hooks
+    assert len(hooks) == 3
+
+
+def test_netplay():
+    import tempfile
+    from pythongb.netplay import local_pair
+
+    path = tempfile.mktemp()
+    gb = make_scrolling_rom(path)
+
+    reference = gb.fork()
+    first, second = local_pair(gb, max_rollback=4)
+
+    movie = tempfile.mktemp()
+    recorder = gb.record_movie(movie)
+
+    buttons = MemoryController.BUTTONS
+    first_buttons = [buttons["right"] if i % 5 < 2 else 0 for i in range(12)]
+    second_buttons = [buttons["up"] if i % 3 == 0 else buttons["a"] for i in range(12)]
+
+    # The second player is 2 frames behind, so the first has to guess their buttons
+    for i in range(12):
+        first.advance(first_buttons[i])
+
+        if i >= 2:
+            second.advance(second_buttons[i - 2])
+
+    for i in range(10, 12):
+        second.advance(second_buttons[i])
+
+    first.synchronise()
+    second.synchronise()
+
+    assert first.rollback_frames > 0
+    assert second.rollback_frames == 0
+
+    for i in range(12):
+        reference.set_buttons(first_buttons[i] | second_buttons[i])
+        reference.run_frame()
+
+    # The movie of the first player's side holds the buttons after the rollbacks
+    recorder.close()
+
+    replay = GameBoy()
+    replay.load_rom(path)
+    replay.play_movie(movie)
+
+    # Both end up where running with everyone's buttons would have
+    states = [machine_state(gameboy) for gameboy in (first.gameboy, second.gameboy, reference, replay)]
+    assert states[0] == states[1] == states[2] == states[3]
+    assert reference.cpu.memory.read(0xFF80) == 0xEE
+
+    first.close()
+    second.close()
+
+    # A player who stops sending leaves the other waiting only so long, and one who goes is noticed straight away
+    first, second = local_pair(gb, max_rollback=2, timeout=0.1)
+
+    for i in range(2):
+        first.advance(0)
+
+    assert_raises(TimeoutError, first.advance, 0)
+
+    second.close()
+    assert_raises((EOFError, ConnectionError), first.advance, 0)
+
+    first.close()
+
+
+def test_rtc():
+    import tempfile
+
+    # MBC3+TIMER+BATTERY
+    gb = make_rom([0x76], tempfile.mktemp(), 0x10)
+    memory = gb.cpu.memory
+    assert memory.banking_type == 3
+
+    # 1 day, 1 hour, 1 minute and 1 second
+    gb.set_rtc(86400 + 3600 + 61)
+
+    def read_rtc(register):
+        memory.write(0x6000, 0x00)
+        memory.write(0x6000, 0x01)
+        memory.write(0x4000, register)
+
+        return memory.read(0xA000)
+
+    memory.write(0x000A, 0x0A)
+    assert [read_rtc(register) for register in range(0x08, 0x0D)] == [1, 1, 1, 1, 0]
+
+    # The time moves on with the CPU clock, not the host's
+    gb.cpu.clock += 2 * MemoryController.CLOCK_SPEED
+    assert read_rtc(0x08) == 3
+
+    # The latched time stays until it is latched again
+    gb.cpu.clock += MemoryController.CLOCK_SPEED
+    assert memory.read(0xA000) == 3
+
+    # Halted it keeps the time it was set to
+    memory.write(0x4000, 0x0C)
+    memory.write(0xA000, 0x40)
+    memory.write(0x4000, 0x08)
+    memory.write(0xA000, 30)
+
+    gb.cpu.clock += 5 * MemoryController.CLOCK_SPEED
+    assert read_rtc(0x08) == 30
+    assert read_rtc(0x0C) == 0x40
+
+    memory.write(0xA000, 0x00)
+    gb.cpu.clock += MemoryController.CLOCK_SPEED
+    assert read_rtc(0x08) == 31
+    assert read_rtc(0x0B) == 1
+
+    # A time before 0 is refused whether the clock is running or halted, so it never reaches a state
+    assert_raises(ValueError, gb.set_rtc, -5)
+    memory.write(0x4000, 0x0C)
+    memory.write(0xA000, 0x40)
+    assert_raises(ValueError, gb.set_rtc, -5)
+    gb.save_state()
+
+    # A CPU on its own has the clock for the latch too
+    cpu = CPU(False)
+    cpu.memory.banking_type = 3
+    cpu.memory.write(0x000A, 0x0A)
+    cpu.memory.write(0x6000, 0x00)
+    cpu.memory.write(0x6000, 0x01)
+    cpu.memory.write(0x4000, 0x08)
+    assert cpu.memory.read(0xA000) == 0
+
+
+def test_movie():
+    import tempfile
+
+    path = tempfile.mktemp()
+    gb = make_scrolling_rom(path)
+
+    movie = tempfile.mktemp()
+    recorder = gb.record_movie(movie)
+
+    # Changes can be made between frames, or queued for a point in the middle of one
+    for i in range(6):
+        gb.set_buttons(["left"] if i % 2 else ["up", "right"])
+        gb.joypad.queue(gb.cpu.clock + 1000 * i, MemoryController.BUTTONS["down"])
+        gb.run_frame()
+
+    recorder.close()
+    assert recorder.events == 13
+
+    # Played back from the start it ends up in the same place
+    replay = GameBoy()
+    replay.load_rom(path)
+
+    assert replay.play_movie(movie) == 6
+    assert machine_state(replay) == machine_state(gb)
+    assert (replay.gpu.latest_frame() == gb.gpu.latest_frame()).all()
+
+    # A button being pressed wakes the CPU from HALT
+    gb = make_rom([0x76], tempfile.mktemp())
+    gb.cpu.memory.write(0xFFFF, 0x10)
+    gb.step()
+
+    gb.joypad.queue(gb.cpu.clock + 5000, MemoryController.BUTTONS["start"])
+    assert_raises(ValueError, gb.joypad.queue, gb.cpu.clock, 0)
+
+    gb.run_frame()
+
+    assert not gb.cpu.halted
+    assert gb.cpu.memory.buttons == MemoryController.BUTTONS["start"]
+
+
+def test_joypad_restore():
+    import tempfile
+
+    path = tempfile.mktemp()
+    gb = make_scrolling_rom(path)
+    memory = gb.cpu.memory
+
+    movie = tempfile.mktemp()
+    recorder = gb.record_movie(movie)
+    rewinder = gb.enable_rewind(interval=1)
+
+    # The changes fall in the middle of frames, so each is first run in a frame run ahead
+    buttons = [MemoryController.BUTTONS[name] for name in ("right", "up", "left", "down", "right", "up")]
+
+    for i, held in enumerate(buttons):
+        gb.joypad.queue(gb.cpu.clock + int(GPU.FRAME_CLOCKS * (i + 1.5)), held)
+
+    plain = gb.fork()
+
+    for i in range(8):
+        gb.run_frame_ahead(2)
+        plain.run_frame()
+
+    assert machine_state(gb) == machine_state(plain)
+    assert memory.read(0xFF80) == 0xEF ^ buttons[-1]
+
+    # Rewound, the changes since happen again
+    assert gb.rewind(6) == 6
+
+    for i in range(6):
+        gb.run_frame()
+
+    assert machine_state(gb) == machine_state(plain)
+
+    # The movie only holds what finally ran, each change once
+    recorder.close()
+    rewinder.close()
+    assert recorder.events == len(buttons) + 1
+
+    replay = GameBoy()
+    replay.load_rom(path)
+    replay.play_movie(movie)
+    assert machine_state(replay) == machine_state(gb)
+
+
+def test_env():
+    import tempfile
+    from pythongb.env import ACTIONS, GameBoyEnv
+
+    path = tempfile.mktemp()
+    make_scrolling_rom(path)
+
+    env = GameBoyEnv(path, frame_skip=3, downsample=2)
+    setup_scrolling(env.gameboy)
+    env.set_start()
+
+    joypad = env.memory_view(0xFF80, 0xFF81)
+    observation = env.make_observation()
+    assert observation.shape == (72, 80)
+
+    first, info = env.reset(observation)
+    assert first is observation
+    assert info["frame"] == 0
+
+    # Each step runs frame_skip frames, drawing only the last
+    observation, info = env.step(ACTIONS.index(["left"]), observation)
+    assert info["frame"] == 3
+    assert joypad[0] == 0xED
+
+    assert set(np.unique(observation)) == {192, 255}
+    assert (observation == env.observe()).all()
+
+    # Back at the start the views see the memory as it was
+    env.reset(observation)
+    assert joypad[0] == 0
+    assert_raises(ValueError, env.memory_view, 0x0000, 0x0100)
+
+    shades = GameBoyEnv(path, observation="shades")
+    assert shades.reset()[0].shape == (144, 160)
+
+
+# Module level so the vector environment's workers can unpickle it
+def setup_scrolling_env(env):
+    setup_scrolling(env.gameboy)
+
+
+def setup_failing_env(env):
+    raise RuntimeError("Setup failed")
+
+
+def test_vector_env():
+    import os
+    import tempfile
+    from pythongb.env import GameBoyEnv
+    from pythongb.vecenv import VectorEnv
+
+    path = tempfile.mktemp()
+    make_scrolling_rom(path)
+
+    envs = VectorEnv(path, 3, processes=2, setup=setup_scrolling_env, frame_skip=2)
+
+    single = GameBoyEnv(path, frame_skip=2)
+    setup_scrolling_env(single)
+    single.set_start()
+
+    observations, info = envs.reset()
+    assert observations.shape == (3, 144, 160)
+    assert (info["frame"] == 0).all()
+
+    # Each environment steps with its own action, the same as one on its own would
+    for actions in ([5, 6, 7], [8, 8, 0], [7, 0, 5]):
+        observations, info = envs.step(actions)
+
+        assert (info["frame"] == single.gameboy.gpu.frame_number + 2).all()
+
+        for i, action in enumerate(actions):
+            state = single.gameboy.save_state()
+            assert (single.step(action)[0] == observations[i]).all()
+
+            if i < 2:
+                single.gameboy.load_state(state)
+
+    envs.close()
+    envs.close()
+
+    # A worker failing to start stops the others and frees the shared memory
+    shared = set(os.listdir("/dev/shm"))
+    assert_raises(RuntimeError, VectorEnv, path, 2, processes=2, setup=setup_failing_env)
+    assert set(os.listdir("/dev/shm")) <= shared